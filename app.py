@@ -1,89 +1,170 @@
 import os
+import base64
+import hashlib
+import warnings
+import weakref
+from functools import wraps
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, redirect, url_for, render_template
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Blueprint, current_app, request, jsonify, redirect, render_template, Response, stream_with_context, g
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
 from flask_cors import CORS
-from flask_admin import Admin, AdminIndexView, expose
-from flask_admin.contrib.sqla import ModelView
-from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_login import LoginManager, login_user, logout_user, current_user, login_required
 import pytz
 from datetime import datetime, timedelta 
 
 # --- Configuração Inicial ---
+# No import só se lê o .env e se constroem objetos baratos (sem rede nem banco);
+# o app Flask é montado em create_app(), no fim do arquivo.
 load_dotenv()
-app = Flask(__name__)
-CORS(app)
+rotas = Blueprint("rotas", __name__)
 
-# Carregar das variáveis de ambiente
-app.secret_key = os.environ.get("FLASK_SECRET_KEY")
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_URL")
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# Credenciais do Twilio
+# Credenciais do Twilio (o Client é criado no primeiro envio de cada processo)
 TWILIO_ACCOUNT_SID = os.environ.get('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.environ.get('TWILIO_AUTH_TOKEN')
 TWILIO_WHATSAPP_NUMBER = os.environ.get('TWILIO_WHATSAPP_NUMBER')
-client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
 # Lista de telefones de administradores (do .env)
-ADMIN_PHONES = os.environ.get("ADMIN_PHONES", "").split(",")
+ADMIN_PHONES = [t.strip() for t in os.environ.get("ADMIN_PHONES", "").split(",") if t.strip()]
 
 # Banco de Dados e Modelos
-from models import db, Usuario, Servico, Agendamento
-db.init_app(app)
+from models import db, ler_da_replica, User, Usuario, Servico, Agendamento, AgendamentoArquivado, EventoAgendamento, NotificacaoPendente, STATUS_ABERTOS
+from migracoes import migrar
+from config import config_banco, dimensionar_threads
+
+# Fila de notificações para os admins (NOTIFICACOES_SENDER=fake usa um sender local, sem rede)
+from notificacoes import FilaNotificacoes, TwilioSender, FakeSender
+if os.environ.get("NOTIFICACOES_SENDER") == "fake": notificador = FakeSender()
+else: notificador = TwilioSender(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_WHATSAPP_NUMBER,
+                                 timeout=int(os.environ.get("NOTIFICACOES_TIMEOUT_ENVIO", 30)))
+fila_notificacoes = FilaNotificacoes(
+    notificador,
+    num_workers=int(os.environ.get("NOTIFICACOES_WORKERS", 2)),
+    max_tentativas=int(os.environ.get("NOTIFICACOES_MAX_TENTATIVAS", 5))
+)
+
+# Cache do catálogo de serviços (por worker, invalidado pelo admin via versão no banco)
+from catalogo import CatalogoServicos
+catalogo = CatalogoServicos(intervalo_verificacao=int(os.environ.get("CATALOGO_INTERVALO_VERIFICACAO", 5)))
 
 # Fusos Horários
 brasil_tz = pytz.timezone('America/Sao_Paulo')
 utc_tz = pytz.utc
 
-# --- Configuração do Admin e Login ---
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
-
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(600), nullable=False)
-    def set_password(self, password): self.password_hash = generate_password_hash(password)
-    def check_password(self, password): return check_password_hash(self.password_hash, password)
+# Cliente Redis compartilhado (opcional: só é importado quando algum backend usa "redis")
+_cliente_redis = None
+def cliente_redis():
+    global _cliente_redis
+    if _cliente_redis is None:
+        import redis
+        _cliente_redis = redis.from_url(os.environ.get("REDIS_URL"))
+    return _cliente_redis
+
+# Sessões da conversa (rascunho do agendamento) com TTL nativo
+# SESSOES_BACKEND: "sql" (padrão), "redis" (usa REDIS_URL) ou "memoria" (testes)
+from sessoes import Sessao, SessoesSQL, SessoesRedis, RedisEmMemoria
+SESSAO_TTL_SEGUNDOS = int(os.environ.get("SESSAO_TTL_SEGUNDOS", 900))
+SESSOES_BACKEND = os.environ.get("SESSOES_BACKEND", "sql")
+if SESSOES_BACKEND == "redis":
+    sessoes = SessoesRedis(cliente_redis(), SESSAO_TTL_SEGUNDOS)
+elif SESSOES_BACKEND == "memoria":
+    sessoes = SessoesRedis(RedisEmMemoria(), SESSAO_TTL_SEGUNDOS)
+else:
+    sessoes = SessoesSQL(SESSAO_TTL_SEGUNDOS)
+
+# Deduplicação dos reenvios do Twilio por MessageSid
+# IDEMPOTENCIA_BACKEND: "memoria" (padrão, por worker e limitado) ou "redis" (compartilhado)
+from idempotencia import IdempotenciaMensagens
+if os.environ.get("IDEMPOTENCIA_BACKEND", "memoria") == "redis":
+    _cliente_idempotencia = cliente_redis()
+else:
+    _cliente_idempotencia = RedisEmMemoria(max_itens=int(os.environ.get("IDEMPOTENCIA_MAX_ITENS", 10000)))
+idempotencia = IdempotenciaMensagens(_cliente_idempotencia, ttl_segundos=int(os.environ.get("IDEMPOTENCIA_TTL_SEGUNDOS", 3600)))
+
+# Proteção do /bot: balde de fichas por telefone + teto de mensagens em processamento no worker
+# LIMITE_BACKEND: "memoria" (padrão, por worker) ou "redis" (compartilhado entre workers)
+# LIMITE_RAJADA mensagens seguidas, repostas a LIMITE_POR_MINUTO.
+# Tetos por worker (BOT_MAX_CONCORRENTES, SSE_MAX_CONEXOES) saem das threads do gunicorn: ver config.dimensionar_threads
+THREADS = dimensionar_threads()
+from limitador import BaldeMemoria, BaldeRedis, LimitadorWebhook
+_rajada = int(os.environ.get("LIMITE_RAJADA", 20))
+_taxa = int(os.environ.get("LIMITE_POR_MINUTO", 60)) / 60
+if os.environ.get("LIMITE_BACKEND", "memoria") == "redis":
+    _balde = BaldeRedis(cliente_redis(), _rajada, _taxa)
+else:
+    _balde = BaldeMemoria(_rajada, _taxa, max_chaves=int(os.environ.get("LIMITE_MAX_TELEFONES", 10000)))
+limitador = LimitadorWebhook(_balde, max_concorrentes=THREADS["bot"])
+
+# Eventos dos agendamentos para o painel (SSE), um poller por worker, até SSE_MAX_CONEXOES painéis
+from eventos import CanalEventos
+SSE_RETRY_SEGUNDOS = int(os.environ.get("SSE_RETRY_SEGUNDOS", 15))
+canal_eventos = CanalEventos(lambda ag: formatar_agendamento(ag),
+                             intervalo_poll=float(os.environ.get("EVENTOS_INTERVALO_POLL", 1.0)),
+                             max_conexoes=THREADS["sse"])
+
+# Exportação em massa (NDJSON/CSV) para relatórios, em lotes com cursor no servidor
+from exportacao import ExportadorAgendamentos, FiltrosExportacao, FiltroInvalido, FORMATOS
+exportador = ExportadorAgendamentos(brasil_tz)
+
+# Máquina de estados da conversa (tabela de despacho + medição por estado)
+from maquina_estados import MaquinaEstados, Contexto
+maquina = MaquinaEstados()
+
+# Motor de disponibilidade (expediente das 9h às 17h, slots de 1 hora; ver disponibilidade.motor_padrao)
+from disponibilidade import motor_padrao, SlotIndisponivel
+disponibilidade = motor_padrao(brasil_tz)
+
+# Comandos de admin em massa pelo WhatsApp (concluir/confirmar/cancelar listas, intervalos e "hoje")
+from comandos_admin import ComandosAdmin
+comandos_admin = ComandosAdmin(brasil_tz, disponibilidade)
+
+# Métricas no formato do Prometheus em /metrics (registro por worker)
+from metricas import registro, MetricasHTTP
+metricas_http = MetricasHTTP(ignorar=("static", "rotas.metricas_prometheus", "rotas.agendamentos_eventos"))
+TIMEOUTS = registro.contador("bot_timeouts_total", "Conversas reiniciadas no menu porque a sessão expirou.")
+
+def _conversas_ativas():
+    # Usuários que falaram com o bot dentro do TTL da sessão (usa ix_usuario_last_interaction_time)
+    limite = datetime.now(utc_tz).replace(tzinfo=None) - timedelta(seconds=SESSAO_TTL_SEGUNDOS)
+    linhas = db.session.query(Usuario.estado_atual, db.func.count(Usuario.id)).filter(
+        Usuario.last_interaction_time >= limite).group_by(Usuario.estado_atual)
+    return [({"estado": estado}, total) for estado, total in linhas]
+
+def _notificacoes_pendentes():
+    return db.session.query(db.func.count(NotificacaoPendente.id)).filter(
+        NotificacaoPendente.status.in_(['pendente', 'enviando'])).scalar()
+
+registro.coletor("bot_conversas_ativas", "Conversas ativas (dentro do TTL da sessão) por estado_atual.",
+                 _conversas_ativas, rotulos=("estado",))
+registro.coletor("bot_mensagens_total", "Mensagens processadas por estado.",
+                 lambda: [({"estado": e}, n) for e, (n, _) in sorted(maquina.contagens().items())],
+                 tipo="counter", rotulos=("estado",))
+registro.coletor("bot_mensagens_erro_total", "Mensagens que terminaram em erro, por estado.",
+                 lambda: [({"estado": e}, n) for e, (_, n) in sorted(maquina.contagens().items())],
+                 tipo="counter", rotulos=("estado",))
+registro.coletor("bot_mensagens_duplicadas_total", "Reenvios do Twilio respondidos pelo cache de MessageSid.",
+                 lambda: idempotencia.duplicadas, tipo="counter")
+registro.coletor("bot_mensagens_limitadas_total", "Mensagens recusadas no /bot, por motivo (telefone ou concorrencia).",
+                 lambda: [({"motivo": m}, n) for m, n in sorted(limitador.rejeitadas.items())],
+                 tipo="counter", rotulos=("motivo",))
+registro.coletor("bot_mensagens_em_andamento", "Mensagens do /bot em processamento no worker.",
+                 lambda: limitador.em_andamento)
+registro.coletor("sse_paineis_conectados", "Painéis conectados ao SSE neste worker.", lambda: canal_eventos.conectados)
+registro.coletor("sse_paineis_recusados_total", "Conexões SSE recusadas (503) por falta de vaga no worker.",
+                 lambda: canal_eventos.recusadas, tipo="counter")
+registro.coletor("notificacoes_pendentes", "Notificações aguardando envio.", _notificacoes_pendentes)
+
+# --- Login do Admin ---
+login_manager = LoginManager()
+login_manager.login_view = 'rotas.login'
 
 @login_manager.user_loader
 def load_user(user_id): return User.query.get(int(user_id))
 
-class MyAdminIndexView(AdminIndexView):
-    @expose('/')
-    def index(self):
-        if not current_user.is_authenticated: return redirect(url_for('login'))
-        return super().index()
-
-class SecureModelView(ModelView):
-    def is_accessible(self): return current_user.is_authenticated
-
-class UsuarioModelView(SecureModelView):
-    column_list = ['nome', 'telefone', 'estado_atual', 'last_interaction_time']
-    column_searchable_list = ['nome', 'telefone']
-
-class ServicoModelView(SecureModelView):
-    column_list = ['nome', 'duracao_minutos']
-    form_columns = ['nome', 'descricao', 'duracao_minutos']
-
-class AgendamentoModelView(SecureModelView):
-    column_list = ['usuario.nome', 'servico.nome', 'data_hora', 'status', 'endereco', 'queixa']
-    column_filters = ['status', 'data_hora', 'servico.nome']
-
-admin = Admin(app, name='Painel Admin', template_mode='bootstrap3', index_view=MyAdminIndexView())
-
-with app.app_context():
-    admin.add_view(UsuarioModelView(Usuario, db.session))
-    admin.add_view(ServicoModelView(Servico, db.session, name='Serviços'))
-    admin.add_view(AgendamentoModelView(Agendamento, db.session))
-    admin.add_view(SecureModelView(User, db.session, name='Admins'))
-
 # --- Rotas de Autenticação Admin ---
-@app.route('/login', methods=['GET', 'POST'])
+@rotas.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated: return redirect('/admin')
     if request.method == 'POST':
@@ -96,14 +177,14 @@ def login():
         Senha: <input type="password" name="password"><br>
         <input type="submit" value="Entrar"></form>'''
 
-@app.route('/logout')
+@rotas.route('/logout')
 @login_required
 def logout():
     logout_user(); return 'Deslogado com sucesso'
 
-@app.route('/criar_admin')
+@rotas.route('/criar_admin')
 def criar_admin():
-    db.create_all() 
+    migrar()
     admin_username = os.environ.get("ADMIN_USERNAME"); admin_password = os.environ.get("ADMIN_PASSWORD")
     if not admin_username or not admin_password: return "Variáveis ADMIN_USERNAME ou ADMIN_PASSWORD não definidas."
     admin_existente = User.query.filter_by(username=admin_username).first()
@@ -113,289 +194,335 @@ def criar_admin():
     return f'Admin "{admin_username}" e tabelas criados com sucesso!'
 
 # --- Rotas Públicas ---
-@app.route('/')
+@rotas.route('/')
 def index():
     return "<h1>Bot de Agendamento no ar!</h1><p>Aponte o webhook do Twilio para /bot.</p>"
 
 # --- Funções Auxiliares do Bot ---
 def listar_servicos_formatado_apenas_lista():
-    servicos = Servico.query.all()
-    if not servicos:
-        return "Nenhum serviço disponível no momento. (Cadastre os serviços no /admin)"
-    lista_texto = "Estes são os nossos serviços:\n\n"
-    for servico in servicos:
-        lista_texto += f"▪️ *{servico.nome}*\n"
-    return lista_texto
+    return catalogo.obter().texto_lista
 
 def listar_servicos_formatado_com_numeros():
-    servicos = Servico.query.all()
-    if not servicos:
-        return "Nenhum serviço disponível no momento. (Cadastre os serviços no /admin)"
-    lista_texto = "Estes são os nossos serviços:\n\n"
-    for i, servico in enumerate(servicos, 1):
-        lista_texto += f"{i}️⃣ - *{servico.nome}*\n"
-    return lista_texto
-
-def gerar_horarios_disponiveis(data_str):
-    horarios_disponiveis = []
+    return catalogo.obter().texto_numerado
+
+def formatar_horarios(horarios):
+    return [f"{i} - {h.hour}:{h.minute:02d}" for i, h in enumerate(horarios, 1)]
+
+def gerar_horarios_disponiveis(data_str, duracao_minutos=None):
     try:
         data_obj = datetime.strptime(data_str, "%d/%m/%Y").date()
-        data_selecionada = brasil_tz.localize(datetime(data_obj.year, data_obj.month, data_obj.day))
-        agora_br = datetime.now(brasil_tz)
-        if data_selecionada.date() < agora_br.date(): return []
-        
-        start_day_utc = data_selecionada.astimezone(utc_tz)
-        end_day_utc = (data_selecionada + timedelta(days=1)).astimezone(utc_tz)
-        start_day_utc_naive = start_day_utc.replace(tzinfo=None)
-        end_day_utc_naive = end_day_utc.replace(tzinfo=None)
-
-        agendamentos_no_dia = Agendamento.query.filter(
-            Agendamento.data_hora >= start_day_utc_naive,
-            Agendamento.data_hora < end_day_utc_naive
-        ).all()
-
-        horas_reservadas = set()
-        for ag in agendamentos_no_dia:
-            hora_agendada_utc = ag.data_hora.replace(tzinfo=utc_tz)
-            hora_agendada_br = hora_agendada_utc.astimezone(brasil_tz)
-            horas_reservadas.add(hora_agendada_br.strftime('%H:%M'))
-
-        hora_inicio = 9; hora_fim = 17; contador_opcao = 1
-        for hora in range(hora_inicio, hora_fim):
-            hora_str = f"{hora}:00"; hora_formatada_comparacao = f"{hora:02d}:00"
-            horario_do_slot = brasil_tz.localize(datetime(data_obj.year, data_obj.month, data_obj.day, hora, 0))
-            if data_obj == agora_br.date() and horario_do_slot < agora_br: continue
-            if hora_formatada_comparacao not in horas_reservadas:
-                horarios_disponiveis.append(f"{contador_opcao} - {hora_str}")
-                contador_opcao += 1
-        return horarios_disponiveis
+        return formatar_horarios(disponibilidade.horarios_livres(data_obj, duracao_minutos))
     except Exception as e:
         print(f"Erro ao gerar horários: {e}"); return []
 
+def duracao_do_servico(servico_id):
+    servico = catalogo.obter().por_id.get(servico_id)
+    return servico.duracao_minutos if servico else None
+
+def sugerir_proximas_datas(duracao_minutos=None):
+    dias = disponibilidade.proximos_dias_livres(quantidade=3, duracao_minutos=duracao_minutos)
+    if not dias: return ""
+    linhas = "\n".join(f"▪️ {dia.strftime('%d/%m/%Y')} ({len(livres)} horários)" for dia, livres in dias)
+    return f"\n\nPróximas datas com horários livres:\n{linhas}"
+
 # --- Rota Principal do Bot ---
-@app.route("/bot", methods=["POST"])
+@rotas.route("/bot", methods=["POST"])
 def processar_mensagem():
     dados = request.form
     telefone_usuario = dados.get("From", "").replace("whatsapp:", "")
     mensagem_usuario = dados.get("Body", "").strip()
     resposta = MessagingResponse()
 
-    GRUPO_INTERNO = os.environ.get("GRUPO_WHATSAPP_INTERNO")
+    # Reenvio do Twilio (mesmo MessageSid): devolve a resposta já dada, sem tocar no banco
+    # e sem gastar ficha do balde do telefone
+    message_sid = dados.get("MessageSid")
+    if message_sid:
+        resposta_anterior = idempotencia.reservar(message_sid)
+        if resposta_anterior is not None: return resposta_anterior
+
+    # Acima do limite (telefone ou worker cheio): resposta pronta, sem banco. O SID é
+    # liberado para um reenvio posterior ser processado de verdade
+    with limitador.entrar(telefone_usuario) as recusa:
+        if recusa is not None:
+            if message_sid: idempotencia.liberar(message_sid)
+            return recusa
+
+        try:
+            resposta_final = _processar_mensagem(telefone_usuario, mensagem_usuario, resposta)
+        except Exception:
+            if message_sid: idempotencia.liberar(message_sid)
+            raise
+        if message_sid: idempotencia.concluir(message_sid, resposta_final)
+        return resposta_final
+
+def _processar_mensagem(telefone_usuario, mensagem_usuario, resposta):
+    # Unidade de trabalho: um único commit por mensagem recebida (medida por estado)
+    with maquina.medir():
+        try:
+            # Sem autoflush: as alterações da mensagem vão ao banco de uma vez, no commit
+            with db.session.no_autoflush:
+                sessao = conduzir_conversa(telefone_usuario, mensagem_usuario, resposta)
+            if sessao is not None and sessoes.transacional: sessoes.salvar(sessao)
+            db.session.commit()
+        except Exception:
+            db.session.rollback(); raise
+        if sessao is not None and not sessoes.transacional: sessoes.salvar(sessao)
+    if g.get("notificacao_enfileirada"): fila_notificacoes.acordar()
+    return str(resposta)
+
+def conduzir_conversa(telefone_usuario, mensagem_usuario, resposta):
+    # --- Comandos de Admin: antes do usuário, da sessão e do timeout (sem sessão para salvar) ---
+    if telefone_usuario in ADMIN_PHONES:
+        texto = comandos_admin.executar(mensagem_usuario)
+        if texto is not None:
+            maquina.marcar("admin")
+            resposta.message(texto)
+            return None
+
     agora_utc = datetime.now(utc_tz) # Pega a hora atual em UTC
 
     usuario = Usuario.query.filter_by(telefone=telefone_usuario).first()
     if not usuario:
+        maquina.marcar("novo_usuario")
         usuario = Usuario(telefone=telefone_usuario, 
                           estado_atual="aguardando_nome",
                           last_interaction_time=agora_utc)
-        db.session.add(usuario); db.session.commit()
+        db.session.add(usuario)
         resposta.message("Olá! Bem-vindo(a) ao nosso sistema de agendamento. Para começar, qual o seu nome?")
-        return str(resposta)
-
-    # --- [LÓGICA DE TIMEOUT CORRIGIDA] ---
-    if not usuario.last_interaction_time:
-        usuario.last_interaction_time = agora_utc
-    
-    # Garante que o objeto do banco de dados seja 'aware'
-    ultima_interacao_aware = usuario.last_interaction_time.replace(tzinfo=utc_tz)
-    delta = agora_utc - ultima_interacao_aware
-    delta_segundos = delta.total_seconds()
-    
-    # 900 segundos = 15 minutos
-    if delta_segundos > 900 and mensagem_usuario.lower() != 'menu':
-        
-        # Força o reset do estado e salva
-        usuario.estado_atual = "menu_principal"
-        usuario.last_interaction_time = agora_utc
-        db.session.commit()
-
-        # Envia a mensagem de reset e PÁRA A EXECUÇÃO
-        resposta.message(f"Você demorou muito para responder. Vamos recomeçar do menu principal.\n\n"
-                         f"1️⃣ Ver Nossos Serviços\n"
-                         f"2️⃣ Agendar um Horário")
-        return str(resposta) 
-    
-    # Se não houve timeout, apenas atualiza o tempo e continua
+        return Sessao(telefone_usuario, nova=True)
+
     usuario.last_interaction_time = agora_utc
-    db.session.commit()
-    # --- [FIM DA LÓGICA DE TIMEOUT] ---
 
-    # --- Comandos de Admin ---
-    if telefone_usuario in ADMIN_PHONES:
-        if mensagem_usuario.lower().startswith("concluir "):
-            try:
-                agendamento_id = int(mensagem_usuario.split(" ")[1])
-                agendamento = Agendamento.query.get(agendamento_id)
-                if agendamento:
-                    agendamento.status = 'Concluido'; db.session.commit()
-                    resposta.message(f"✅ Agendamento *{agendamento_id}* marcado como Concluído.")
-                else: resposta.message(f"Agendamento {agendamento_id} não encontrado.")
-            except (ValueError, IndexError):
-                resposta.message("Formato inválido. Use: *concluir [ID]*")
-            return str(resposta)
+    # --- Timeout: a sessão expira sozinha (TTL) após SESSAO_TTL_SEGUNDOS sem mensagens ---
+    sessao = sessoes.carregar(telefone_usuario)
+    if sessao is None:
+        sessao = Sessao(telefone_usuario, nova=True)
+        if mensagem_usuario.lower() != 'menu':
+            maquina.marcar("timeout")
+            TIMEOUTS.inc()
+            usuario.estado_atual = "menu_principal"
+            resposta.message(f"Você demorou muito para responder. Vamos recomeçar do menu principal.\n\n"
+                             f"1️⃣ Ver Nossos Serviços\n"
+                             f"2️⃣ Agendar um Horário")
+            return sessao
 
     # --- Máquina de Estados da Conversa ---
-    if usuario.estado_atual == "aguardando_nome":
-        usuario.nome = mensagem_usuario
-        usuario.estado_atual = "menu_principal"
-        db.session.commit()
-        resposta.message(f"Olá, {usuario.nome}!\nComo posso te ajudar hoje?\n\n"
+    # 'menu' vale em qualquer estado, exceto enquanto o nome ainda não foi informado
+    estado = usuario.estado_atual
+    if estado != "aguardando_nome" and mensagem_usuario.lower() == 'menu':
+        estado = "comando_menu"
+    maquina.despachar(estado, Contexto(usuario, sessao, mensagem_usuario, resposta))
+    return sessao
+
+# --- Handlers dos estados (registrados na tabela de despacho) ---
+@maquina.estado("aguardando_nome")
+def estado_aguardando_nome(ctx):
+    usuario = ctx.usuario
+    usuario.nome = ctx.mensagem
+    usuario.estado_atual = "menu_principal"
+    ctx.resposta.message(f"Olá, {usuario.nome}!\nComo posso te ajudar hoje?\n\n"
                          "1️⃣ Ver Nossos Serviços\n"
                          "2️⃣ Agendar um Horário")
-        return str(resposta)
 
-    if mensagem_usuario.lower() == 'menu':
-        usuario.estado_atual = "menu_principal"; db.session.commit()
-        resposta.message(f"Ok, {usuario.nome}. Voltamos ao menu principal.\n\n"
+@maquina.estado("comando_menu")
+def estado_comando_menu(ctx):
+    ctx.usuario.estado_atual = "menu_principal"
+    ctx.resposta.message(f"Ok, {ctx.usuario.nome}. Voltamos ao menu principal.\n\n"
                          "1️⃣ Ver Nossos Serviços\n"
                          "2️⃣ Agendar um Horário")
-        return str(resposta)
-    
-    if usuario.estado_atual == "menu_principal":
-        if mensagem_usuario == "1":
-            servicos_formatados = listar_servicos_formatado_apenas_lista()
-            resposta.message(f"{servicos_formatados}\n\nDigite '2' para agendar ou 'menu' para voltar.")
-        elif mensagem_usuario == "2":
-            usuario.estado_atual = "agendando_servico"
-            db.session.commit()
-            servicos_formatados = listar_servicos_formatado_com_numeros()
-            resposta.message(f"{servicos_formatados}\n\nPor favor, digite o *número* do serviço que você deseja agendar.")
-        else:
-            resposta.message("Opção inválida. Por favor, escolha uma das opções abaixo:\n"
+
+@maquina.estado("menu_principal")
+def estado_menu_principal(ctx):
+    if ctx.mensagem == "1":
+        servicos_formatados = listar_servicos_formatado_apenas_lista()
+        ctx.resposta.message(f"{servicos_formatados}\n\nDigite '2' para agendar ou 'menu' para voltar.")
+    elif ctx.mensagem == "2":
+        # Guarda a versão do catálogo mostrada para a numeração não mudar até a escolha
+        snapshot = catalogo.obter()
+        ctx.usuario.estado_atual = "agendando_servico"
+        ctx.sessao["catalogo_versao"] = snapshot.versao
+        ctx.resposta.message(f"{snapshot.texto_numerado}\n\nPor favor, digite o *número* do serviço que você deseja agendar.")
+    else:
+        ctx.resposta.message("Opção inválida. Por favor, escolha uma das opções abaixo:\n"
                              "1️⃣ Ver Nossos Serviços\n"
                              "2️⃣ Agendar um Horário")
-        return str(resposta)
 
-    if usuario.estado_atual == "agendando_servico":
-        try:
-            servicos = Servico.query.all()
-            servico_escolhido = servicos[int(mensagem_usuario) - 1]
-            usuario.temp_servico_id = servico_escolhido.id
-            usuario.estado_atual = "coletando_endereco"
-            db.session.commit()
-            resposta.message(f"Ótima escolha: *{servico_escolhido.nome}*.\n\n"
+@maquina.estado("agendando_servico")
+def estado_agendando_servico(ctx):
+    snapshot = catalogo.obter_versao(ctx.sessao.get("catalogo_versao"))
+    if snapshot is None:
+        # O catálogo mudou desde que o menu foi mostrado: mostra a lista atualizada
+        snapshot = catalogo.obter()
+        ctx.sessao["catalogo_versao"] = snapshot.versao
+        ctx.resposta.message(f"A lista de serviços foi atualizada.\n\n{snapshot.texto_numerado}\n\n"
+                             "Por favor, digite o *número* do serviço que você deseja agendar.")
+        return
+    try:
+        servico_escolhido = snapshot.escolher(int(ctx.mensagem))
+        ctx.sessao["servico_id"] = servico_escolhido.id
+        ctx.sessao.pop("catalogo_versao", None)
+        ctx.usuario.estado_atual = "coletando_endereco"
+        ctx.resposta.message(f"Ótima escolha: *{servico_escolhido.nome}*.\n\n"
                              "Para continuar, por favor, informe o *endereço completo* (Rua, Número, Bairro):")
-        except (ValueError, IndexError):
-            resposta.message("Por favor, digite um *número válido* da lista de serviços.")
-        return str(resposta)
-
-    if usuario.estado_atual == "coletando_endereco":
-        usuario.temp_endereco = mensagem_usuario
-        usuario.estado_atual = "coletando_queixa"
-        db.session.commit()
-        resposta.message("Qual a *queixa* do ar-condicionado? (ex: não gela, barulho, pingando, etc.)")
-        return str(resposta)
-
-    if usuario.estado_atual == "coletando_queixa":
-        usuario.temp_queixa = mensagem_usuario
-        usuario.estado_atual = "coletando_btus"
-        db.session.commit()
-        resposta.message("Quantos *BTUs* tem o aparelho? (ex: 9000, 12000, 18000)")
-        return str(resposta)
-        
-    if usuario.estado_atual == "coletando_btus":
-        usuario.temp_btus = mensagem_usuario
-        usuario.estado_atual = "coletando_marca"
-        db.session.commit()
-        resposta.message("Qual a *marca* do ar-condicionado? (ex: LG, Samsung, Consul, etc.)")
-        return str(resposta)
-
-    if usuario.estado_atual == "coletando_marca":
-        usuario.temp_marca = mensagem_usuario
-        usuario.estado_atual = "agendando_data"
-        db.session.commit()
-        resposta.message("Obrigado pelas informações.\n\n"
-                         "Agora, por favor, digite a *data* que você deseja o atendimento (ex: 25/12/2025).")
-        return str(resposta)
-
-    if usuario.estado_atual == "agendando_data":
-        horarios = gerar_horarios_disponiveis(mensagem_usuario)
-        if not horarios:
-            resposta.message("Data inválida, no passado ou sem horários disponíveis. Por favor, digite uma data futura no formato DD/MM/YYYY.")
-            return str(resposta)
-        usuario.temp_data = mensagem_usuario
-        usuario.estado_atual = "agendando_horario"
-        db.session.commit()
-        horarios_texto = "\n".join(horarios)
-        resposta.message(f"Estes são os horários disponíveis para {mensagem_usuario}:\n\n"
+    except (ValueError, IndexError):
+        ctx.resposta.message("Por favor, digite um *número válido* da lista de serviços.")
+
+# Coleta dos dados do esboço: (campo na sessão, próximo estado, pergunta seguinte)
+ETAPAS_COLETA = {
+    "coletando_endereco": ("endereco", "coletando_queixa",
+                           "Qual a *queixa* do ar-condicionado? (ex: não gela, barulho, pingando, etc.)"),
+    "coletando_queixa": ("queixa", "coletando_btus",
+                         "Quantos *BTUs* tem o aparelho? (ex: 9000, 12000, 18000)"),
+    "coletando_btus": ("btus", "coletando_marca",
+                       "Qual a *marca* do ar-condicionado? (ex: LG, Samsung, Consul, etc.)"),
+}
+
+@maquina.estado(*ETAPAS_COLETA)
+def estado_coletando(ctx):
+    campo, proximo_estado, pergunta = ETAPAS_COLETA[ctx.usuario.estado_atual]
+    ctx.sessao[campo] = ctx.mensagem
+    ctx.usuario.estado_atual = proximo_estado
+    ctx.resposta.message(pergunta)
+
+@maquina.estado("coletando_marca")
+def estado_coletando_marca(ctx):
+    ctx.sessao["marca"] = ctx.mensagem
+    ctx.usuario.estado_atual = "agendando_data"
+    sugestoes = sugerir_proximas_datas(duracao_do_servico(ctx.sessao.get("servico_id")))
+    ctx.resposta.message("Obrigado pelas informações.\n\n"
+                         "Agora, por favor, digite a *data* que você deseja o atendimento (ex: 25/12/2025)."
+                         f"{sugestoes}")
+
+@maquina.estado("agendando_data")
+def estado_agendando_data(ctx):
+    usuario, sessao, mensagem_usuario, resposta = ctx.usuario, ctx.sessao, ctx.mensagem, ctx.resposta
+    duracao = duracao_do_servico(sessao.get("servico_id"))
+    try:
+        data_obj = datetime.strptime(mensagem_usuario, "%d/%m/%Y").date()
+        livres = disponibilidade.horarios_livres(data_obj, duracao)
+    except ValueError:
+        livres = []
+    if not livres:
+        resposta.message("Data inválida, no passado ou sem horários disponíveis. Por favor, digite uma data futura no formato DD/MM/YYYY."
+                         f"{sugerir_proximas_datas(duracao)}")
+        return
+    # Memoriza a lista mostrada: a resposta do usuário é resolvida contra ela, sem recalcular
+    sessao["data"] = mensagem_usuario
+    sessao["horarios"] = [h.strftime('%H:%M') for h in livres]
+    usuario.estado_atual = "agendando_horario"
+    horarios_texto = "\n".join(formatar_horarios(livres))
+    resposta.message(f"Estes são os horários disponíveis para {mensagem_usuario}:\n\n"
+                     f"{horarios_texto}\n\n"
+                     "Digite o *número* do horário que você prefere.")
+
+def responder_horario_ocupado(ctx, dia, duracao):
+    livres = disponibilidade.horarios_livres(dia, duracao)
+    ctx.sessao["horarios"] = [h.strftime('%H:%M') for h in livres]
+    if not livres:
+        ctx.usuario.estado_atual = "agendando_data"; ctx.sessao.pop("data", None)
+        ctx.resposta.message("Esse horário acabou de ser reservado e não há mais horários neste dia. "
+                             f"Por favor, digite outra data (DD/MM/YYYY).{sugerir_proximas_datas(duracao)}")
+        return
+    horarios_texto = "\n".join(formatar_horarios(livres))
+    ctx.resposta.message(f"Esse horário acabou de ser reservado. Estes são os horários ainda disponíveis:\n\n"
                          f"{horarios_texto}\n\n"
                          "Digite o *número* do horário que você prefere.")
-        return str(resposta)
 
-    if usuario.estado_atual == "agendando_horario":
+@maquina.estado("agendando_horario")
+def estado_agendando_horario(ctx):
+    usuario, sessao, mensagem_usuario, resposta = ctx.usuario, ctx.sessao, ctx.mensagem, ctx.resposta
+    GRUPO_INTERNO = os.environ.get("GRUPO_WHATSAPP_INTERNO")
+    try:
+        duracao = duracao_do_servico(sessao.get("servico_id"))
+        horarios_mostrados = sessao.get("horarios")
+        if not horarios_mostrados:
+            horarios_mostrados = [h.split(" - ")[1] for h in gerar_horarios_disponiveis(sessao["data"], duracao)]
+        opcao = int(mensagem_usuario)
+        if opcao < 1: raise IndexError(opcao)
+        horario_selecionado_str = horarios_mostrados[opcao - 1]
+        hora, minuto = map(int, horario_selecionado_str.split(':'))
+        data_agendamento = datetime.strptime(sessao["data"], "%d/%m/%Y")
+        data_hora_naive = datetime(data_agendamento.year, data_agendamento.month, data_agendamento.day, hour=hora, minute=minuto)
+        data_hora_brasil = brasil_tz.localize(data_hora_naive)
+        data_hora_utc = data_hora_brasil.astimezone(utc_tz)
+
+        # Só o horário escolhido é conferido de novo (alguém pode tê-lo reservado nesse meio tempo)
+        if not disponibilidade.esta_livre(data_hora_brasil, duracao):
+            responder_horario_ocupado(ctx, data_agendamento.date(), duracao)
+            return
+
+        novo_agendamento = Agendamento(
+            usuario_id=usuario.id,
+            servico_id=sessao.get("servico_id"),
+            data_hora=data_hora_utc,
+            endereco=sessao.get("endereco"),
+            queixa=sessao.get("queixa"),
+            btus=sessao.get("btus"),
+            marca=sessao.get("marca")
+        )
+        db.session.add(novo_agendamento)
+        usuario.estado_atual = "menu_principal"
         try:
-            horarios_disponis = gerar_horarios_disponiveis(usuario.temp_data)
-            horario_selecionado_str = horarios_disponis[int(mensagem_usuario) - 1].split(" - ")[1]
-            hora, minuto = map(int, horario_selecionado_str.split(':'))
-            data_agendamento = datetime.strptime(usuario.temp_data, "%d/%m/%Y")
-            data_hora_naive = datetime(data_agendamento.year, data_agendamento.month, data_agendamento.day, hour=hora, minute=minuto)
-            data_hora_brasil = brasil_tz.localize(data_hora_naive)
-            data_hora_utc = data_hora_brasil.astimezone(utc_tz)
-
-            novo_agendamento = Agendamento(
-                usuario_id=usuario.id,
-                servico_id=usuario.temp_servico_id,
-                data_hora=data_hora_utc,
-                endereco=usuario.temp_endereco,
-                queixa=usuario.temp_queixa,
-                btus=usuario.temp_btus,
-                marca=usuario.temp_marca
+            # O flush grava o agendamento e as vagas dele (hook de reservas em disponibilidade.py)
+            db.session.flush()
+        except (SlotIndisponivel, IntegrityError):
+            # Outro worker levou a vaga entre a conferência e o INSERT: desfaz e oferece os horários restantes
+            db.session.rollback()
+            responder_horario_ocupado(ctx, data_agendamento.date(), duracao)
+            return
+        sessao.clear()
+
+        servico = catalogo.obter().por_id.get(novo_agendamento.servico_id) or Servico.query.get(novo_agendamento.servico_id)
+
+        resposta.message(f"👍 Solicitação de agendamento recebida!\n\n"
+                         f"Serviço: *{servico.nome}*\n"
+                         f"Data: *{data_hora_brasil.strftime('%d/%m/%Y')}*\n"
+                         f"Horário: *{data_hora_brasil.strftime('%H:%M')}*\n\n"
+                         "Em breve nossa equipe entrará em contato para confirmar.\n"
+                         "Para um novo serviço, digite 'menu'.")
+        
+        numero_destino = None
+        if GRUPO_INTERNO: numero_destino = GRUPO_INTERNO
+        elif ADMIN_PHONES: numero_destino = f"whatsapp:{ADMIN_PHONES[0]}" 
+
+        if numero_destino:
+            mensagem_notificacao = (
+                f"🔔 *Nova Solicitação (ID: {novo_agendamento.id})*\n\n"
+                f"*Cliente:* {usuario.nome}\n"
+                f"*Telefone:* {usuario.telefone}\n"
+                f"*Serviço:* {servico.nome}\n\n"
+                f"*Data:* {data_hora_brasil.strftime('%d/%m/%Y às %H:%M')}\n\n"
+                f"*Local:* {novo_agendamento.endereco}\n"
+                f"*Queixa:* {novo_agendamento.queixa}\n"
+                f"*BTUs:* {novo_agendamento.btus}\n"
+                f"*Marca:* {novo_agendamento.marca}\n\n"
+                f"Para concluir, responda: *concluir {novo_agendamento.id}*"
             )
-            db.session.add(novo_agendamento)
-            
-            usuario.estado_atual = "menu_principal"
-            usuario.temp_data = None; usuario.temp_servico_id = None;
-            usuario.temp_endereco = None; usuario.temp_queixa = None;
-            usuario.temp_btus = None; usuario.temp_marca = None;
-            db.session.commit()
+            # Gravada no mesmo commit do agendamento; os workers da fila fazem a entrega
+            fila_notificacoes.enfileirar(numero_destino, mensagem_notificacao)
+            g.notificacao_enfileirada = True
+        
+    except (ValueError, IndexError, KeyError):
+        resposta.message("Por favor, digite um *número de horário válido* da lista.")
+    except Exception as e:
+        db.session.rollback(); maquina.marcar_erro()
+        print(f"Erro inesperado no agendamento: {e}")
+        resposta.message("Ocorreu um erro ao tentar agendar. Tente novamente.")
+
+@maquina.estado_padrao
+def estado_desconhecido(ctx):
+    ctx.usuario.estado_atual = 'menu_principal'
+    ctx.resposta.message(f"Desculpe, não entendi. Voltamos ao menu principal.\n\n"
+                         "1️⃣ Ver Nossos Serviços\n"
+                         "2️⃣ Agendar um Horário")
 
-            servico = Servico.query.get(novo_agendamento.servico_id)
-
-            resposta.message(f"👍 Solicitação de agendamento recebida!\n\n"
-                             f"Serviço: *{servico.nome}*\n"
-                             f"Data: *{data_hora_brasil.strftime('%d/%m/%Y')}*\n"
-                             f"Horário: *{data_hora_brasil.strftime('%H:%M')}*\n\n"
-                             "Em breve nossa equipe entrará em contato para confirmar.\n"
-                             "Para um novo serviço, digite 'menu'.")
-            
-            numero_destino = None
-            if GRUPO_INTERNO: numero_destino = GRUPO_INTERNO
-            elif ADMIN_PHONES: numero_destino = f"whatsapp:{ADMIN_PHONES[0]}" 
-
-            if numero_destino:
-                mensagem_notificacao = (
-                    f"🔔 *Nova Solicitação (ID: {novo_agendamento.id})*\n\n"
-                    f"*Cliente:* {usuario.nome}\n"
-                    f"*Telefone:* {usuario.telefone}\n"
-                    f"*Serviço:* {servico.nome}\n\n"
-                    f"*Data:* {data_hora_brasil.strftime('%d/%m/%Y às %H:%M')}\n\n"
-                    f"*Local:* {novo_agendamento.endereco}\n"
-                    f"*Queixa:* {novo_agendamento.queixa}\n"
-                    f"*BTUs:* {novo_agendamento.btus}\n"
-                    f"*Marca:* {novo_agendamento.marca}\n\n"
-                    f"Para concluir, responda: *concluir {novo_agendamento.id}*"
-                )
-                try:
-                    client.messages.create(
-                        body=mensagem_notificacao,
-                        from_=TWILIO_WHATSAPP_NUMBER,
-                        to=numero_destino
-                    )
-                except Exception as e: print(f"Erro ao enviar notificação para {numero_destino}: {e}")
-            
-        except (ValueError, IndexError):
-            resposta.message("Por favor, digite um *número de horário válido* da lista.")
-        except Exception as e:
-            print(f"Erro inesperado no agendamento: {e}")
-            resposta.message("Ocorreu um erro ao tentar agendar. Tente novamente.")
-            
-        return str(resposta)
-
-    usuario.estado_atual = 'menu_principal'; db.session.commit()
-    resposta.message(f"Desculpe, não entendi. Voltamos ao menu principal.\n\n"
-                     "1️⃣ Ver Nossos Serviços\n"
-                     "2️⃣ Agendar um Horário")
-    return str(resposta)
+@rotas.route("/metricas/estados", methods=["GET"])
+def metricas_estados():
+    return jsonify(maquina.resumo())
+
+@rotas.route("/metrics", methods=["GET"])
+def metricas_prometheus():
+    return Response(registro.exportar(), mimetype="text/plain; version=0.0.4")
 
 # --- ROTAS DE API (Atualizadas com novos campos) ---
 def formatar_agendamento(agendamento):
@@ -408,6 +535,7 @@ def formatar_agendamento(agendamento):
         "data_agendamento": data_hora_brasil.strftime('%d/%m/%Y'),
         "hora_agendamento": data_hora_brasil.strftime('%H:%M'),
         "data_criacao_utc": agendamento.data_criacao.isoformat(),
+        "atualizado_em_utc": agendamento.atualizado_em.isoformat() if agendamento.atualizado_em else None,
         "cliente": {
             "nome": agendamento.usuario.nome,
             "telefone": agendamento.usuario.telefone
@@ -424,27 +552,272 @@ def formatar_agendamento(agendamento):
         }
     }
 
-@app.route("/agendamentos/abertos", methods=["GET"])
+# --- Paginação por cursor (keyset) sobre (data_hora, id) ---
+TAMANHO_LOTE_API = 500
+LIMITE_MAXIMO_API = 1000
+# ?since= com limite: a página pode crescer até este múltiplo do limite (ver listar_alteracoes)
+TETO_EXTENSAO_SINCE = 4
+
+def _codificar_cursor(agendamento):
+    bruto = f"{agendamento.data_hora.isoformat()}|{agendamento.id}"
+    return base64.urlsafe_b64encode(bruto.encode()).decode()
+
+def _decodificar_cursor(cursor):
+    data_str, id_str = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(data_str), int(id_str)
+
+def _consulta_apos_cursor(consulta, cursor, decrescente, modelo=Agendamento):
+    if cursor:
+        data_hora, agendamento_id = cursor
+        if decrescente:
+            consulta = consulta.filter(or_(modelo.data_hora < data_hora,
+                                           and_(modelo.data_hora == data_hora, modelo.id < agendamento_id)))
+        else:
+            consulta = consulta.filter(or_(modelo.data_hora > data_hora,
+                                           and_(modelo.data_hora == data_hora, modelo.id > agendamento_id)))
+    if decrescente: return consulta.order_by(modelo.data_hora.desc(), modelo.id.desc())
+    return consulta.order_by(modelo.data_hora.asc(), modelo.id.asc())
+
+def _gerar_json(lotes):
+    # Monta o array JSON pedaço por pedaço, sem materializar a lista inteira
+    yield "["
+    primeiro = True
+    for lote in lotes:
+        for agendamento in lote:
+            yield ("" if primeiro else ",") + current_app.json.dumps(formatar_agendamento(agendamento))
+            primeiro = False
+        db.session.expunge_all()
+    yield "]"
+
+def _lotes_por_cursor(consulta, cursor, decrescente, modelo=Agendamento):
+    while True:
+        lote = _consulta_apos_cursor(consulta, cursor, decrescente, modelo).limit(TAMANHO_LOTE_API).all()
+        if not lote: return
+        yield lote
+        if len(lote) < TAMANHO_LOTE_API: return
+        cursor = (lote[-1].data_hora, lote[-1].id)
+
+# --- Requisições condicionais (ETag) e feed incremental (?since=) ---
+def _versao_listagem():
+    # Versão da tabela = último evento do log (+ versão do catálogo, pelos nomes dos serviços),
+    # combinada com a URL no ETag. Lida antes dos dados: na dúvida, o cliente baixa de novo.
+    # Os ids do log ficam visíveis em ordem de commit (trava em eventos._gravar), então
+    # nenhum evento com id menor aparece depois que o ETag ou o X-Proximo-Since o passaram.
+    # Editar nome/telefone de um cliente gera eventos para os agendamentos dele (eventos.py).
+    ultimo_evento = canal_eventos.ultimo_id()
+    versao = f"{request.path}?{request.query_string.decode()}|{ultimo_evento}.{catalogo.obter().versao}"
+    return ultimo_evento, hashlib.sha1(versao.encode()).hexdigest()
+
+def _gerar_alteracoes(itens, removidos):
+    yield "["
+    separador = ""
+    for agendamento in itens:
+        yield separador + current_app.json.dumps(formatar_agendamento(agendamento)); separador = ","
+    for agendamento_id in removidos:
+        yield separador + current_app.json.dumps({"id_agendamento": agendamento_id, "removido": True}); separador = ","
+    yield "]"
+
+def _eventos_apos(desde_id, ate_id=None, limite=None):
+    consulta = db.session.query(EventoAgendamento.id, EventoAgendamento.agendamento_id, EventoAgendamento.tipo).filter(
+        EventoAgendamento.id > desde_id)
+    if ate_id is not None: consulta = consulta.filter(EventoAgendamento.id <= ate_id)
+    return consulta.order_by(EventoAgendamento.id).limit(limite).all()
+
+def listar_alteracoes(consulta, desde_id, limite, cabecalhos):
+    # Só os agendamentos com eventos depois do cursor. Quem saiu da listagem (concluído,
+    # cancelado, apagado) volta como marcador {"id_agendamento": X, "removido": true}.
+    eventos = _eventos_apos(desde_id, limite=limite)
+    tem_mais = len(eventos) == limite
+    # O limite vem antes da escolha dos marcadores: a página se estende até o último evento
+    # de cada agendamento dela (até TETO_EXTENSAO_SINCE x o limite). O estado devolvido é o
+    # atual, então um agendamento criado e concluído não pode ter o 'novo' numa página e a
+    # saída na seguinte, que mandaria o marcador de algo que o cliente nunca recebeu.
+    while tem_mais and len(eventos) < limite * TETO_EXTENSAO_SINCE:
+        fim = eventos[-1][0]
+        alem = db.session.query(db.func.max(EventoAgendamento.id)).filter(
+            EventoAgendamento.id > fim,
+            EventoAgendamento.agendamento_id.in_({agendamento_id for _, agendamento_id, _ in eventos})).scalar()
+        if alem is None: break
+        eventos += _eventos_apos(fim, alem)
+
+    tipos = {}
+    for _, agendamento_id, tipo in eventos: tipos.setdefault(agendamento_id, set()).add(tipo)
+    itens = consulta.filter(Agendamento.id.in_(tipos)).order_by(Agendamento.id).all() if tipos else []
+    presentes = {ag.id for ag in itens}
+    # Criado depois do cursor e já fora da listagem: o cliente nunca o recebeu, sem marcador
+    removidos = sorted(i for i, t in tipos.items() if i not in presentes and 'novo' not in t)
+
+    cabecalhos["X-Proximo-Since"] = str(eventos[-1][0] if eventos else desde_id)
+    if tem_mais: cabecalhos["X-Tem-Mais"] = "1"
+    return Response(stream_with_context(_gerar_alteracoes(itens, removidos)),
+                    mimetype="application/json", headers=cabecalhos)
+
+def listar_agendamentos(consulta, decrescente, modelo=Agendamento):
+    # ?limite=N devolve uma página e o cursor da próxima em X-Proximo-Cursor;
+    # sem limite, a lista inteira é transmitida em lotes pelo mesmo cursor.
+    # ?since=V devolve só o que mudou desde a versão V (header X-Proximo-Since).
+    # `modelo` é Agendamento ou AgendamentoArquivado (mesmas colunas).
+    consulta = consulta.options(joinedload(modelo.usuario), joinedload(modelo.servico))
+    try:
+        cursor = _decodificar_cursor(request.args["cursor"]) if request.args.get("cursor") else None
+        limite = request.args.get("limite", type=int)
+        since = request.args.get("since")
+        desde_id = int(since) if since else None
+    except (ValueError, TypeError):
+        return jsonify({"erro": "Cursor inválido."}), 400
+
+    ultimo_evento, etag = _versao_listagem()
+    cabecalhos = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=cabecalhos)
+
+    if desde_id is not None:
+        if modelo is not Agendamento:
+            return jsonify({"erro": "?since não vale para o arquivo."}), 400
+        return listar_alteracoes(consulta, desde_id, max(1, min(limite or LIMITE_MAXIMO_API, LIMITE_MAXIMO_API)), cabecalhos)
+
+    cabecalhos["X-Proximo-Since"] = str(ultimo_evento)
+    if limite:
+        limite = max(1, min(limite, LIMITE_MAXIMO_API))
+        pagina = _consulta_apos_cursor(consulta, cursor, decrescente, modelo).limit(limite + 1).all()
+        if len(pagina) > limite:
+            pagina = pagina[:limite]
+            cabecalhos["X-Proximo-Cursor"] = _codificar_cursor(pagina[-1])
+        lotes = [pagina]
+    else:
+        lotes = _lotes_por_cursor(consulta, cursor, decrescente, modelo)
+
+    return Response(stream_with_context(_gerar_json(lotes)), mimetype="application/json", headers=cabecalhos)
+
+# Rotas só de leitura: as consultas vão para a réplica, quando configurada; o /bot fica no primário
+def somente_leitura(view):
+    @wraps(view)
+    def na_replica(*args, **kwargs):
+        ler_da_replica()
+        return view(*args, **kwargs)
+    return na_replica
+
+def consulta_abertos():
+    return Agendamento.query.filter(Agendamento.status.in_(STATUS_ABERTOS))
+
+def consulta_concluidos(arquivo=False):
+    if arquivo: return AgendamentoArquivado.query.filter_by(status='Concluido')
+    return Agendamento.query.filter_by(status='Concluido')
+
+@rotas.route("/agendamentos/abertos", methods=["GET"])
+@somente_leitura
 def agendamentos_abertos():
     try:
-        agendamentos = Agendamento.query.filter(
-            Agendamento.status.in_(['Aberto', 'Confirmado'])
-        ).order_by(Agendamento.data_hora.asc()).all()
-        lista_agendamentos = [formatar_agendamento(ag) for ag in agendamentos]
-        return jsonify(lista_agendamentos)
+        return listar_agendamentos(consulta_abertos(), decrescente=False)
     except Exception as e: return jsonify({"erro": str(e)}), 500
 
-@app.route("/agendamentos/concluidos", methods=["GET"])
+@rotas.route("/agendamentos/concluidos", methods=["GET"])
+@somente_leitura
 def agendamentos_concluidos():
+    # ?arquivo=1 lê os concluídos já movidos para o arquivo (ver manutencao.py)
+    arquivo = request.args.get("arquivo") == "1"
     try:
-        agendamentos = Agendamento.query.filter_by(
-            status='Concluido'
-        ).order_by(Agendamento.data_hora.desc()).all()
-        lista_agendamentos = [formatar_agendamento(ag) for ag in agendamentos]
-        return jsonify(lista_agendamentos)
+        return listar_agendamentos(consulta_concluidos(arquivo), decrescente=True,
+                                   modelo=AgendamentoArquivado if arquivo else Agendamento)
     except Exception as e: return jsonify({"erro": str(e)}), 500
 
+@rotas.route("/agendamentos/exportar", methods=["GET"])
+@somente_leitura
+def agendamentos_exportar():
+    # ?formato=ndjson|csv &de=DD/MM/AAAA &ate=DD/MM/AAAA &status=Concluido,Aberto &arquivo=1
+    formato = request.args.get("formato", "ndjson")
+    if formato not in FORMATOS: return jsonify({"erro": "Formato inválido. Use ndjson ou csv."}), 400
+    try:
+        filtros = FiltrosExportacao.interpretar(request.args.get("de"), request.args.get("ate"), request.args.get("status"),
+                                                request.args.get("arquivo") == "1")
+    except FiltroInvalido as e:
+        return jsonify({"erro": str(e)}), 400
+    nome_arquivo = f"agendamentos.{formato}"
+    return Response(stream_with_context(exportador.gerar(filtros, formato)), mimetype=FORMATOS[formato],
+                    headers={"Content-Disposition": f"attachment; filename={nome_arquivo}"})
+
+# --- Painel de operações: eventos em tempo real (SSE) ---
+def snapshot_abertos():
+    agendamentos = consulta_abertos().options(
+        joinedload(Agendamento.usuario), joinedload(Agendamento.servico)
+    ).order_by(Agendamento.data_hora.asc(), Agendamento.id.asc())
+    return [formatar_agendamento(ag) for ag in agendamentos]
+
+@rotas.route("/agendamentos/eventos", methods=["GET"])
+def agendamentos_eventos():
+    # O EventSource reenvia o Last-Event-ID sozinho ao reconectar
+    ultimo = request.headers.get("Last-Event-ID") or request.args.get("desde")
+    try:
+        desde_id = int(ultimo) if ultimo else None
+    except ValueError:
+        return jsonify({"erro": "Last-Event-ID inválido."}), 400
+    # Worker lotado de painéis: 503 na hora (a thread volta para o /bot) e o painel tenta de novo
+    if not canal_eventos.abrir():
+        return Response(f"retry: {SSE_RETRY_SEGUNDOS * 1000}\n\n", status=503, mimetype="text/event-stream",
+                        headers={"Retry-After": str(SSE_RETRY_SEGUNDOS), "Cache-Control": "no-cache"})
+    resposta = Response(stream_with_context(canal_eventos.stream(desde_id, snapshot_abertos)),
+                        mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    # O servidor fecha a resposta mesmo se o stream nem começar (cliente que desistiu)
+    resposta.call_on_close(canal_eventos.fechar)
+    return resposta
+
+@rotas.route("/painel")
+def painel():
+    return render_template("index.html")
+
+# --- Fábrica do app ---
+# Fork-safe (gunicorn --preload): o filho descarta as conexões herdadas do pai sem
+# fechá-las (o socket continua sendo do pai) e abre as suas sob demanda.
+# Um único hook para o processo, que passa pelos apps ainda vivos (o Windows não tem fork).
+_apps_criados = weakref.WeakSet()
+
+def _descartar_conexoes_herdadas():
+    for app_criado in list(_apps_criados):
+        with app_criado.app_context():
+            for engine in db.engines.values(): engine.dispose(close=False)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_descartar_conexoes_herdadas)
+
+def create_app(config=None, admin=None):
+    # admin=None segue ADMIN_HABILITADO (padrão: ligado); o Flask-Admin só é importado se usado.
+    # Um app por processo: a fila de notificações, o canal de eventos e o catálogo são
+    # do módulo e passam a servir o app mais recente
+    if len(_apps_criados):
+        warnings.warn("create_app() chamado de novo neste processo: fila_notificacoes e canal_eventos "
+                      "passam a usar o novo app", RuntimeWarning, stacklevel=2)
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("FLASK_SECRET_KEY")
+    app.config.update(config_banco())  # primário, réplica (DATABASE_REPLICA_URL) e pool
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if config: app.config.update(config)
+
+    CORS(app)
+    db.init_app(app)
+    login_manager.init_app(app)
+    fila_notificacoes.init_app(app)
+    canal_eventos.init_app(app)
+    metricas_http.init_app(app)
+    app.register_blueprint(rotas)
+
+    if admin is None: admin = os.environ.get("ADMIN_HABILITADO", "1") != "0"
+    if admin:
+        from painel_admin import init_admin
+        init_admin(app, catalogo)
+
+    _apps_criados.add(app)
+    return app
+
+# `from app import app` / `gunicorn app:app` continuam funcionando: o app é criado no primeiro acesso
+def __getattr__(nome):
+    if nome == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
 
 if __name__ == "__main__":
-    with app.app_context(): db.create_all()
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
\ No newline at end of file
+    app = create_app()
+    with app.app_context(): migrar()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
@@ -0,0 +1,283 @@
+"""Benchmark do /bot: simula milhares de telefones fazendo o fluxo completo de agendamento.
+
+Uso:
+    python benchmark.py --telefones 2000 --concorrencia 16 --saida baseline.json
+    python benchmark.py --telefones 2000 --comparar baseline.json
+    python benchmark.py --url http://localhost:8000 --telefones 500   # contra um gunicorn no ar
+
+Sem --url, o app roda no próprio processo (test client do Flask) com Twilio falso
+e o banco de --database-url (padrão: um SQLite temporário) e os limites do /bot desligados.
+
+Sai com erro se alguma conversa iniciada não terminar confirmada: recusas do limitador
+(que também respondem 200) contam em "recusadas" e encerram a conversa, fora das latências.
+
+Também mede o boot de um worker (import do app.py e create_app(), em processos novos),
+comparado com o baseline como os demais grupos.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from limitador import LimitadorWebhook
+
+# Passos do fluxo: (estado em que a mensagem chega, texto enviado)
+FLUXO = [
+    ("novo_usuario", "oi"),
+    ("aguardando_nome", "Cliente {i}"),
+    ("menu_principal", "2"),
+    ("agendando_servico", "1"),
+    ("coletando_endereco", "Rua {i}, 100, Centro"),
+    ("coletando_queixa", "não gela"),
+    ("coletando_btus", "12000"),
+    ("coletando_marca", "LG"),
+    ("agendando_data", "{data}"),
+    ("agendando_horario", "1"),
+]
+SLOTS_POR_DIA = 8
+# Os telefones de um mesmo dia disputam os mesmos slots: o último pode perder para todos os outros
+MAX_TENTATIVAS_HORARIO = SLOTS_POR_DIA
+# Recusas do limitador chegam com status 200: contam à parte e encerram a conversa
+RECUSAS = {"telefone": LimitadorWebhook.RESPOSTA_TELEFONE, "concorrencia": LimitadorWebhook.RESPOSTA_CONCORRENCIA}
+
+
+def percentis(amostras):
+    if not amostras: return {"n": 0}
+    ordenadas = sorted(amostras)
+    def p(q): return round(ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))] * 1000, 3)
+    return {
+        "n": len(ordenadas),
+        "media_ms": round(sum(ordenadas) / len(ordenadas) * 1000, 3),
+        "p50_ms": p(0.50), "p95_ms": p(0.95), "p99_ms": p(0.99),
+        "max_ms": round(ordenadas[-1] * 1000, 3),
+    }
+
+
+class ClienteLocal:
+    # Roda o app no mesmo processo, com sender de notificações falso. Os limites do /bot ficam
+    # desligados (um processo só, sem gunicorn), a não ser que venham do ambiente.
+    def __init__(self, database_url):
+        os.environ["DATABASE_URL"] = database_url
+        os.environ.setdefault("NOTIFICACOES_SENDER", "fake")
+        os.environ.setdefault("FLASK_SECRET_KEY", "benchmark")
+        os.environ.setdefault("BOT_MAX_CONCORRENTES", "0")
+        os.environ.setdefault("LIMITE_RAJADA", "1000")
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import app as modulo_app
+        from models import db, Servico
+        self.app = modulo_app.create_app(admin=False)
+        with self.app.app_context():
+            if db.engine.dialect.name == "sqlite": self._ajustar_sqlite(db.engine)
+            db.create_all()
+            if not Servico.query.first():
+                db.session.add(Servico(nome="Limpeza", duracao_minutos=60)); db.session.commit()
+        self._local = threading.local()
+
+    @staticmethod
+    def _ajustar_sqlite(engine):
+        # WAL + busy_timeout: leitores não bloqueiam o escritor e a disputa vira espera, não erro
+        from sqlalchemy import event
+        @event.listens_for(engine, "connect")
+        def _pragmas(conexao, _):
+            cursor = conexao.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute("PRAGMA busy_timeout=30000")
+            cursor.close()
+        engine.dispose()
+
+    def _cliente(self):
+        if not hasattr(self._local, "cliente"): self._local.cliente = self.app.test_client()
+        return self._local.cliente
+
+    def post(self, caminho, dados):
+        r = self._cliente().post(caminho, data=dados)
+        return r.status_code, r.get_data(as_text=True)
+
+    def get(self, caminho):
+        r = self._cliente().get(caminho)
+        return r.status_code, r.get_data(as_text=True)
+
+    # Horários com mais agendamentos do que a capacidade (deve ser sempre 0)
+    def reservas_duplicadas(self):
+        from sqlalchemy import func
+        from models import db, Agendamento
+        import app as modulo_app
+        with self.app.app_context():
+            consulta = db.session.query(Agendamento.data_hora).filter(
+                Agendamento.status != 'Cancelado').group_by(Agendamento.data_hora).having(
+                func.count(Agendamento.id) > modulo_app.disponibilidade.capacidade)
+            return consulta.count()
+
+
+class ClienteHTTP:
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip("/")
+        self._local = threading.local()
+        self._requests = requests
+
+    def _sessao(self):
+        if not hasattr(self._local, "sessao"): self._local.sessao = self._requests.Session()
+        return self._local.sessao
+
+    def post(self, caminho, dados):
+        r = self._sessao().post(self.url + caminho, data=dados, timeout=30)
+        return r.status_code, r.text
+
+    def get(self, caminho):
+        r = self._sessao().get(self.url + caminho, timeout=60)
+        return r.status_code, r.text
+
+
+# Boot de um worker, cada repetição num processo novo: import do app.py e create_app()
+def medir_inicializacao(database_url, repeticoes=5):
+    codigo = ("import time; t0 = time.perf_counter(); import app; t1 = time.perf_counter(); "
+              "app.create_app(); print(t1 - t0, time.perf_counter() - t1)")
+    ambiente = dict(os.environ, DATABASE_URL=database_url, NOTIFICACOES_SENDER="fake")
+    imports, fabricas = [], []
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, "-c", codigo], cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=ambiente, capture_output=True, text=True, check=True).stdout
+        tempo_import, tempo_fabrica = map(float, saida.split()[-2:])
+        imports.append(tempo_import); fabricas.append(tempo_fabrica)
+    return {"import_app": percentis(imports), "create_app": percentis(fabricas)}
+
+
+def executar(cliente, telefones, concorrencia, prefixo):
+    latencias = {estado: [] for estado, _ in FLUXO}
+    erros = {estado: 0 for estado, _ in FLUXO}
+    confirmadas = [0]
+    conflitos = [0]
+    recusadas = {motivo: 0 for motivo in RECUSAS}
+    lock = threading.Lock()
+    primeiro_dia = datetime.now().date() + timedelta(days=1)
+
+    def conversa(i):
+        telefone = f"whatsapp:+{prefixo}{i:07d}"
+        data = (primeiro_dia + timedelta(days=i // SLOTS_POR_DIA)).strftime("%d/%m/%Y")
+        for estado, modelo in FLUXO:
+            # No último passo, um conflito de vaga (outro telefone levou o horário) é repetido
+            for _ in range(MAX_TENTATIVAS_HORARIO if estado == "agendando_horario" else 1):
+                dados = {"From": telefone, "Body": modelo.format(i=i, data=data), "MessageSid": uuid.uuid4().hex}
+                inicio = time.perf_counter()
+                try:
+                    status, corpo = cliente.post("/bot", dados)
+                except Exception:
+                    status, corpo = 0, ""
+                duracao = time.perf_counter() - inicio
+                recusa = next((motivo for motivo, texto in RECUSAS.items() if texto in corpo), None)
+                if recusa:
+                    with lock: recusadas[recusa] += 1
+                    return
+                with lock:
+                    latencias[estado].append(duracao)
+                    if status != 200: erros[estado] += 1
+                    if estado == "agendando_horario" and "recebida" in corpo: confirmadas[0] += 1
+                if "acabou de ser reservado" not in corpo: break
+                with lock: conflitos[0] += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(conversa, range(telefones)))
+    duracao_total = time.perf_counter() - inicio
+
+    todas = [d for lista in latencias.values() for d in lista]
+    resultado = {
+        "duracao_s": round(duracao_total, 3),
+        "mensagens": len(todas),
+        "vazao_msgs_s": round(len(todas) / duracao_total, 2),
+        "vazao_conversas_s": round(telefones / duracao_total, 2),
+        "conversas_iniciadas": telefones,
+        "conversas_confirmadas": confirmadas[0],
+        "conflitos_de_vaga": conflitos[0],
+        "recusadas": recusadas,
+        "estados": {estado: dict(percentis(lista), erros=erros[estado]) for estado, lista in latencias.items()},
+        "endpoints": {"/bot": percentis(todas)},
+    }
+
+    # Endpoints de listagem, depois da carga
+    for caminho in ("/agendamentos/abertos?limite=100", "/agendamentos/abertos", "/agendamentos/concluidos?limite=100"):
+        amostras = []
+        for _ in range(20):
+            inicio = time.perf_counter(); cliente.get(caminho); amostras.append(time.perf_counter() - inicio)
+        resultado["endpoints"][caminho] = percentis(amostras)
+    return resultado
+
+
+def comparar(atual, baseline, tolerancia):
+    regressoes = []
+    for grupo in ("estados", "endpoints", "inicializacao"):
+        for nome, base in baseline.get(grupo, {}).items():
+            novo = atual.get(grupo, {}).get(nome)
+            if not novo or not base.get("p95_ms"): continue
+            variacao = (novo["p95_ms"] - base["p95_ms"]) / base["p95_ms"]
+            marca = "REGRESSÃO" if variacao > tolerancia else ""
+            print(f"{grupo}/{nome:<40} p95 {base['p95_ms']:>9.3f} -> {novo['p95_ms']:>9.3f} ms ({variacao:+.1%}) {marca}")
+            if marca: regressoes.append(f"{grupo}/{nome}")
+    variacao = (atual["vazao_msgs_s"] - baseline["vazao_msgs_s"]) / baseline["vazao_msgs_s"]
+    print(f"vazão {baseline['vazao_msgs_s']} -> {atual['vazao_msgs_s']} msgs/s ({variacao:+.1%})")
+    if variacao < -tolerancia: regressoes.append("vazao")
+    return regressoes
+
+
+# Toda conversa iniciada tem de terminar confirmada; senão as latências medem outra coisa
+def falhas(resultado):
+    motivos = []
+    if resultado["conversas_confirmadas"] < resultado["conversas_iniciadas"]:
+        motivos.append(f"{resultado['conversas_confirmadas']} de {resultado['conversas_iniciadas']} conversas confirmadas "
+                       f"(recusadas pelo limitador: {resultado['recusadas']})")
+    if resultado.get("reservas_duplicadas"):
+        motivos.append(f"{resultado['reservas_duplicadas']} horários acima da capacidade")
+    return motivos
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--telefones", type=int, default=1000)
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--url", help="URL de um servidor no ar (senão roda o app no processo)")
+    parser.add_argument("--database-url", help="Banco usado no modo local (padrão: SQLite temporário)")
+    parser.add_argument("--saida", help="Grava o resultado (JSON) para servir de baseline")
+    parser.add_argument("--comparar", help="Baseline (JSON) para comparar o resultado")
+    parser.add_argument("--tolerancia", type=float, default=0.20, help="Piora aceitável no p95/vazão (0.20 = 20%%)")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'benchmark.db')}"
+    inicializacao = medir_inicializacao(database_url)
+    cliente = ClienteHTTP(args.url) if args.url else ClienteLocal(database_url)
+
+    # Prefixo novo a cada execução para não reaproveitar conversas de rodadas anteriores
+    prefixo = str(int(time.time()) % 100000).zfill(5)
+    resultado = executar(cliente, args.telefones, args.concorrencia, prefixo)
+    resultado["inicializacao"] = inicializacao
+    if hasattr(cliente, "reservas_duplicadas"): resultado["reservas_duplicadas"] = cliente.reservas_duplicadas()
+    resultado["meta"] = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "telefones": args.telefones,
+        "concorrencia": args.concorrencia,
+        "alvo": args.url or "local",
+        "python": sys.version.split()[0],
+    }
+
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f: json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+    erros = falhas(resultado)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f: baseline = json.load(f)
+        erros += [f"regressão em {nome}" for nome in comparar(resultado, baseline, args.tolerancia)]
+    if erros:
+        print(f"Falhou: {'; '.join(erros)}"); sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
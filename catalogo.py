@@ -0,0 +1,98 @@
+import threading
+import time
+from collections import namedtuple, OrderedDict
+
+from sqlalchemy import update
+
+from models import db, Servico, VersaoCatalogo
+
+# Cópia imutável do serviço: não fica presa a nenhuma sessão do SQLAlchemy
+ItemCatalogo = namedtuple('ItemCatalogo', ['id', 'nome', 'descricao', 'duracao_minutos'])
+
+SEM_SERVICOS = "Nenhum serviço disponível no momento. (Cadastre os serviços no /admin)"
+
+
+class SnapshotCatalogo:
+    def __init__(self, versao, servicos):
+        self.versao = versao
+        self.servicos = tuple(servicos)
+        self.por_id = {s.id: s for s in self.servicos}
+
+        # Textos do menu já renderizados
+        if not self.servicos:
+            self.texto_lista = self.texto_numerado = SEM_SERVICOS
+        else:
+            self.texto_lista = "Estes são os nossos serviços:\n\n" + "".join(
+                f"▪️ *{s.nome}*\n" for s in self.servicos)
+            self.texto_numerado = "Estes são os nossos serviços:\n\n" + "".join(
+                f"{i}️⃣ - *{s.nome}*\n" for i, s in enumerate(self.servicos, 1))
+
+    # Escolha pelo número mostrado no menu (1-based)
+    def escolher(self, numero):
+        if numero < 1: raise IndexError(numero)
+        return self.servicos[numero - 1]
+
+
+class CatalogoServicos:
+    # Cache por worker. A versão gravada em VersaoCatalogo é o que avisa os outros
+    # workers do gunicorn; ela é consultada no máximo a cada `intervalo_verificacao` s.
+    def __init__(self, intervalo_verificacao=5, versoes_retidas=5):
+        self.intervalo_verificacao = intervalo_verificacao
+        self.versoes_retidas = versoes_retidas
+        self._snapshots = OrderedDict()
+        self._atual = None
+        self._ultima_verificacao = 0.0
+        self._lock = threading.Lock()
+
+    def _versao_banco(self):
+        versao = db.session.query(VersaoCatalogo.versao).filter_by(id=1).scalar()
+        return versao or 0
+
+    def _carregar(self, versao):
+        servicos = [ItemCatalogo(s.id, s.nome, s.descricao, s.duracao_minutos)
+                    for s in db.session.query(Servico).order_by(Servico.id)]
+        return SnapshotCatalogo(versao, servicos)
+
+    def obter(self):
+        agora = time.monotonic()
+        with self._lock:
+            if self._atual is not None and agora - self._ultima_verificacao < self.intervalo_verificacao:
+                return self._atual
+
+        versao = self._versao_banco()
+        with self._lock:
+            self._ultima_verificacao = agora
+            if self._atual is not None and self._atual.versao == versao:
+                return self._atual
+
+        snapshot = self._carregar(versao)
+        # Catálogo vazio não fica em cache: o primeiro cadastro aparece na hora
+        if not snapshot.servicos: return snapshot
+        with self._lock:
+            self._atual = snapshot
+            self._snapshots[versao] = snapshot
+            while len(self._snapshots) > self.versoes_retidas:
+                self._snapshots.popitem(last=False)
+        return snapshot
+
+    # Snapshot de uma versão já mostrada ao usuário (mantém a numeração estável)
+    def obter_versao(self, versao):
+        if versao is None: return None
+        with self._lock:
+            snapshot = self._snapshots.get(versao)
+        if snapshot is None:
+            atual = self.obter()
+            if atual.versao == versao: snapshot = atual
+        return snapshot
+
+    # Chamado pelo admin após criar/editar/excluir serviços
+    def invalidar(self):
+        resultado = db.session.execute(
+            update(VersaoCatalogo).where(VersaoCatalogo.id == 1)
+            .values(versao=VersaoCatalogo.versao + 1)
+        )
+        if resultado.rowcount == 0:
+            db.session.add(VersaoCatalogo(id=1, versao=1))
+        db.session.commit()
+        with self._lock:
+            self._atual = None
@@ -0,0 +1,107 @@
+import re
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import update, or_, and_
+
+from models import db, Agendamento, STATUS_ABERTOS
+from eventos import registrar_eventos
+
+# verbo -> (status novo, status de origem aceitos, tipo do evento, rótulo na resposta)
+ACOES = {
+    "concluir": ("Concluido", ("Aberto", "Confirmado"), "concluido", "concluído(s)"),
+    "confirmar": ("Confirmado", ("Aberto",), "atualizado", "confirmado(s)"),
+    "cancelar": ("Cancelado", ("Aberto", "Confirmado"), "atualizado", "cancelado(s)"),
+}
+_COMANDO = re.compile(r"^\s*(concluir|confirmar|cancelar)\b\s*(.*)$", re.IGNORECASE | re.DOTALL)
+_ITEM = re.compile(r"^(\d+)(?:-(\d+))?$")
+AJUDA = ("Formato inválido. Use, por exemplo:\n"
+         "*concluir 12*  ·  *concluir 12,15,18*  ·  *concluir 10-20*  ·  *concluir hoje*\n"
+         "(o mesmo vale para *confirmar* e *cancelar*)")
+
+
+class ComandoInvalido(ValueError):
+    pass
+
+
+# "concluir 3, 5 7-9" -> ("concluir", {3, 5}, [(7, 9)], False); None se não for um comando de admin
+def interpretar(mensagem):
+    encontrado = _COMANDO.match(mensagem)
+    if not encontrado: return None
+    verbo, argumentos = encontrado.group(1).lower(), encontrado.group(2).strip().lower()
+    if argumentos == "hoje": return verbo, set(), [], True
+    ids, intervalos = set(), []
+    for item in filter(None, re.split(r"[,\s]+", argumentos)):
+        partes = _ITEM.match(item)
+        if not partes: raise ComandoInvalido(item)
+        inicio, fim = int(partes.group(1)), int(partes.group(2) or partes.group(1))
+        if inicio > fim: inicio, fim = fim, inicio
+        if inicio == fim: ids.add(inicio)
+        else: intervalos.append((inicio, fim))
+    if not ids and not intervalos: raise ComandoInvalido(argumentos)
+    return verbo, ids, intervalos, False
+
+
+def _resumir_ids(ids, maximo=30):
+    ids = sorted(ids)
+    texto = ", ".join(str(i) for i in ids[:maximo])
+    return texto + (f" … (+{len(ids) - maximo})" if len(ids) > maximo else "")
+
+
+class ComandosAdmin:
+    # Cada comando vira um único UPDATE ... RETURNING, seguido do log de eventos (painel/feed)
+    # e, no cancelamento, da liberação das vagas. Uma resposta só, com o resumo.
+    def __init__(self, fuso, disponibilidade, max_por_comando=500):
+        self.fuso = fuso
+        self.disponibilidade = disponibilidade
+        self.max_por_comando = max_por_comando
+
+    def _hoje_utc(self):
+        hoje = datetime.now(self.fuso).date()
+        inicio = self.fuso.localize(datetime(hoje.year, hoje.month, hoje.day))
+        fim = self.fuso.localize(datetime.combine(hoje + timedelta(days=1), datetime.min.time()))
+        return inicio.astimezone(pytz.utc).replace(tzinfo=None), fim.astimezone(pytz.utc).replace(tzinfo=None)
+
+    # Texto da resposta, ou None se a mensagem não for um comando de admin
+    def executar(self, mensagem):
+        try:
+            comando = interpretar(mensagem)
+        except ComandoInvalido:
+            return AJUDA
+        if comando is None: return None
+        verbo, ids, intervalos, hoje = comando
+        status_novo, origens, tipo_evento, rotulo = ACOES[verbo]
+
+        pedidos = len(ids) + sum(fim - inicio + 1 for inicio, fim in intervalos)
+        if pedidos > self.max_por_comando:
+            return f"Máximo de {self.max_por_comando} agendamentos por comando."
+
+        condicoes = []
+        if ids: condicoes.append(Agendamento.id.in_(ids))
+        condicoes += [Agendamento.id.between(inicio, fim) for inicio, fim in intervalos]
+        if hoje:
+            inicio, fim = self._hoje_utc()
+            condicoes.append(and_(Agendamento.data_hora >= inicio, Agendamento.data_hora < fim))
+
+        agora = datetime.now(pytz.utc).replace(tzinfo=None)
+        alterados = db.session.execute(
+            update(Agendamento)
+            .where(or_(*condicoes), Agendamento.status.in_(origens))
+            .values(status=status_novo, atualizado_em=agora)
+            .returning(Agendamento.id),
+            execution_options={"synchronize_session": False}
+        ).scalars().all()
+
+        registrar_eventos(db.session, alterados, tipo_evento)
+        if status_novo not in STATUS_ABERTOS: self.disponibilidade.liberar(alterados)
+
+        if hoje:
+            if not alterados: return f"Nenhum agendamento de hoje para {verbo}."
+            return f"✅ {len(alterados)} agendamento(s) de hoje {rotulo}: {_resumir_ids(alterados)}"
+
+        texto = f"✅ {len(alterados)} agendamento(s) {rotulo}" + (f": {_resumir_ids(alterados)}" if alterados else ".")
+        ignorados = set(ids).union(*(range(inicio, fim + 1) for inicio, fim in intervalos)) - set(alterados)
+        if ignorados:
+            texto += (f"\nIgnorados (não encontrados ou com status que não permite {verbo}): "
+                      f"{_resumir_ids(ignorados)}")
+        return texto
@@ -1,5 +1,61 @@
-
 import os
 
 DATABASE_URL = os.getenv("")
 DEBUG = True
+
+# --- Banco: primário, réplica de leitura e pool de conexões ---
+# Lido do ambiente na criação do app (create_app), não no import, para o .env e os
+# scripts (benchmark, verificar_planos) poderem definir as variáveis antes.
+#   DATABASE_URL           primário (escritas e o /bot)
+#   DATABASE_REPLICA_URL   réplica (opcional): listagens, exportação e listas do admin
+#   DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE (s), DB_POOL_PRE_PING (0/1)
+POOL_PADRAO = {"DB_POOL_SIZE": 5, "DB_MAX_OVERFLOW": 10, "DB_POOL_TIMEOUT": 30, "DB_POOL_RECYCLE": 1800}
+
+
+def _em_memoria(url):
+    return url.startswith("sqlite") and (":memory:" in url or url.rstrip("/") == "sqlite:")
+
+
+# Opções do create_engine para uma URL (SQLite em memória usa um pool sem tamanho)
+def opcoes_engine(url):
+    pool = {chave: int(os.getenv(chave, padrao)) for chave, padrao in POOL_PADRAO.items()}
+    opcoes = {"pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") != "0", "pool_recycle": pool["DB_POOL_RECYCLE"]}
+    if url and not _em_memoria(url):
+        opcoes.update(pool_size=pool["DB_POOL_SIZE"], max_overflow=pool["DB_MAX_OVERFLOW"],
+                      pool_timeout=pool["DB_POOL_TIMEOUT"])
+    return opcoes
+
+
+# Chaves SQLALCHEMY_* do app: bind padrão (primário) e, se configurada, a bind "replica"
+def config_banco():
+    url, url_replica = os.getenv("DATABASE_URL"), os.getenv("DATABASE_REPLICA_URL")
+    config = {"SQLALCHEMY_DATABASE_URI": url, "SQLALCHEMY_ENGINE_OPTIONS": opcoes_engine(url)}
+    if url_replica:
+        config["SQLALCHEMY_BINDS"] = {"replica": {"url": url_replica, **opcoes_engine(url_replica)}}
+    return config
+
+
+# --- Threads por worker (gunicorn.conf.py: worker gthread) ---
+# Também lido do ambiente, pelo gunicorn.conf.py e pelo app. Cada painel SSE aberto prende
+# uma thread do worker enquanto estiver conectado; as outras atendem /bot, listagens e admin.
+# Regra: GUNICORN_THREADS = SSE_MAX_CONEXOES + as threads do /bot e do resto (ao menos 2).
+#   GUNICORN_THREADS      threads por worker (padrão 16)
+#   SSE_MAX_CONEXOES      painéis por worker (padrão: 1/4 das threads); o excedente recebe 503 com retry
+#   BOT_MAX_CONCORRENTES  mensagens do /bot em processamento por worker; tem de ficar abaixo do que
+#                         sobra do SSE, senão o teto nunca enche (padrão: sobra menos 2; 0 desliga)
+THREADS_PADRAO = 16
+THREADS_LIVRES_MINIMO = 2
+
+
+def dimensionar_threads(threads=None):
+    threads = threads or int(os.getenv("GUNICORN_THREADS", THREADS_PADRAO))
+    sse = int(os.getenv("SSE_MAX_CONEXOES", threads // 4))
+    if not 0 <= sse <= threads - THREADS_LIVRES_MINIMO:
+        raise ValueError(f"SSE_MAX_CONEXOES={sse} não cabe em {threads} threads por worker "
+                         f"(ao menos {THREADS_LIVRES_MINIMO} ficam para o /bot e as listagens)")
+    livres = threads - sse
+    bot = int(os.getenv("BOT_MAX_CONCORRENTES", max(1, livres - THREADS_LIVRES_MINIMO)))
+    if bot and not 0 < bot < livres:
+        raise ValueError(f"BOT_MAX_CONCORRENTES={bot} precisa ficar abaixo das {livres} threads que "
+                         f"sobram do SSE em cada worker ({threads} - {sse}), senão o teto nunca é atingido")
+    return {"threads": threads, "sse": sse, "bot": bot}
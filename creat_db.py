@@ -1,3 +1,4 @@
-from app import app, db
-with app.app_context():
-    db.create_all()
+from app import create_app
+from migracoes import migrar
+with create_app(admin=False).app_context():
+    migrar()
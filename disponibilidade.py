@@ -0,0 +1,196 @@
+import os
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+import pytz
+from sqlalchemy import event, delete, insert, inspect, select
+from sqlalchemy.orm import Session
+
+import eventos  # noqa: F401 (registra o hook de eventos antes do de reservas)
+from models import db, agora_utc, Agendamento, Servico, ReservaSlot, STATUS_ABERTOS
+
+
+class SlotIndisponivel(Exception):
+    pass
+
+
+class MotorDisponibilidade:
+    # Ocupação de cada dia guardada como bitmap: bit i = slot i do expediente lotado
+    # (`capacidade` atendimentos simultâneos). Serviços longos ocupam vários slots seguidos.
+    ativo = None  # o último motor criado (o do app.py); o hook de reservas usa a grade dele
+
+    def __init__(self, fuso, hora_inicio=9, hora_fim=17, minutos_slot=60, capacidade=1):
+        MotorDisponibilidade.ativo = self
+        self.fuso = fuso
+        self.capacidade = capacidade
+        self.hora_inicio = hora_inicio
+        self.hora_fim = hora_fim
+        self.minutos_slot = minutos_slot
+        self.num_slots = (hora_fim - hora_inicio) * 60 // minutos_slot
+
+    def _inicio_dia_utc(self, dia):
+        # Meia-noite local do dia, em UTC "naive" (como as colunas são gravadas)
+        meia_noite = self.fuso.localize(datetime(dia.year, dia.month, dia.day))
+        return meia_noite.astimezone(pytz.utc).replace(tzinfo=None)
+
+    def _slots_necessarios(self, duracao_minutos):
+        duracao = duracao_minutos or self.minutos_slot
+        return max(1, -(-duracao // self.minutos_slot))
+
+    # Slots da grade [primeiro, último) que o intervalo toca, a partir do minuto de início
+    # contado do começo do expediente: 09:30-10:30 ocupa o das 9h e o das 10h
+    def _indices_tocados(self, minuto_inicio, duracao_minutos):
+        fim = minuto_inicio + (duracao_minutos or self.minutos_slot)
+        return int(minuto_inicio // self.minutos_slot), int(-(-fim // self.minutos_slot))
+
+    def horario_do_slot(self, dia, indice):
+        minutos = self.hora_inicio * 60 + indice * self.minutos_slot
+        return self.fuso.localize(datetime(dia.year, dia.month, dia.day, minutos // 60, minutos % 60))
+
+    # Agendamentos em [inicio_utc, fim_utc) com a duração do serviço (usa ix_agendamento_data_hora)
+    def consulta_ocupacao(self, inicio_utc, fim_utc):
+        return db.session.query(Agendamento.data_hora, Servico.duracao_minutos).join(
+            Servico, Agendamento.servico_id == Servico.id
+        ).filter(
+            Agendamento.data_hora >= inicio_utc,
+            Agendamento.data_hora < fim_utc,
+            Agendamento.status.in_(STATUS_ABERTOS)
+        )
+
+    # Uma única consulta para o intervalo [primeiro_dia, primeiro_dia + num_dias)
+    def ocupacao(self, primeiro_dia, num_dias=1):
+        dias = [primeiro_dia + timedelta(days=i) for i in range(num_dias)]
+        inicios = [self._inicio_dia_utc(d) for d in dias]
+        fim = self._inicio_dia_utc(primeiro_dia + timedelta(days=num_dias))
+
+        contagens = {dia: [0] * self.num_slots for dia in dias}
+        for data_hora, duracao in self.consulta_ocupacao(inicios[0], fim):
+            i = bisect_right(inicios, data_hora) - 1
+            minuto = (data_hora - inicios[i]).total_seconds() / 60 - self.hora_inicio * 60
+            primeiro, ultimo = self._indices_tocados(minuto, duracao)
+            for s in range(max(primeiro, 0), min(ultimo, self.num_slots)): contagens[dias[i]][s] += 1
+
+        bitmaps = {}
+        for dia, contagem in contagens.items():
+            bitmaps[dia] = sum(1 << s for s, n in enumerate(contagem) if n >= self.capacidade)
+        return bitmaps
+
+    def _livres_no_bitmap(self, dia, bitmap, duracao_minutos, agora):
+        necessarios = self._slots_necessarios(duracao_minutos)
+        mascara = (1 << necessarios) - 1
+        livres = []
+        for indice in range(self.num_slots - necessarios + 1):
+            if bitmap & (mascara << indice): continue
+            horario = self.horario_do_slot(dia, indice)
+            if horario < agora: continue
+            livres.append(horario)
+        return livres
+
+    # Horários (datetime local) em que um serviço de `duracao_minutos` cabe no dia
+    def horarios_livres(self, dia, duracao_minutos=None, agora=None):
+        agora = agora or datetime.now(self.fuso)
+        if dia < agora.date(): return []
+        bitmap = self.ocupacao(dia)[dia]
+        return self._livres_no_bitmap(dia, bitmap, duracao_minutos, agora)
+
+    # Próximos `quantidade` dias com vaga, a partir de `a_partir`, com uma só consulta
+    def proximos_dias_livres(self, a_partir=None, quantidade=3, duracao_minutos=None, max_dias=30, agora=None):
+        agora = agora or datetime.now(self.fuso)
+        a_partir = max(a_partir or agora.date(), agora.date())
+        bitmaps = self.ocupacao(a_partir, max_dias)
+        resultado = []
+        for dia in sorted(bitmaps):
+            livres = self._livres_no_bitmap(dia, bitmaps[dia], duracao_minutos, agora)
+            if livres: resultado.append((dia, livres))
+            if len(resultado) >= quantidade: break
+        return resultado
+
+    # Confere um único horário já escolhido (sem recalcular a lista inteira)
+    def esta_livre(self, horario, duracao_minutos=None, agora=None):
+        agora = agora or datetime.now(self.fuso)
+        if horario < agora: return False
+        dia = horario.date()
+        minutos = horario.hour * 60 + horario.minute - self.hora_inicio * 60
+        if minutos % self.minutos_slot: return False
+        indice = minutos // self.minutos_slot
+        necessarios = self._slots_necessarios(duracao_minutos)
+        if indice < 0 or indice + necessarios > self.num_slots: return False
+        mascara = ((1 << necessarios) - 1) << indice
+        return not (self.ocupacao(dia)[dia] & mascara)
+
+    # Grava as vagas ocupadas pelo agendamento (pela conexão da transação atual). A constraint
+    # única (slot_inicio, vaga) faz o INSERT falhar com IntegrityError se outro worker levou a
+    # mesma vaga antes; sem vaga livre já visível, levanta SlotIndisponivel.
+    # Um horário fora da grade (o admin aceita 09:30) reserva todos os slots que toca, como no bitmap.
+    def reservar(self, conexao, agendamento_id, data_hora_utc, duracao_minutos=None):
+        inicios = self.slots_da_reserva(data_hora_utc, duracao_minutos)
+
+        ocupadas = {}
+        for slot_inicio, vaga in conexao.execute(select(ReservaSlot.slot_inicio, ReservaSlot.vaga).where(
+                ReservaSlot.slot_inicio.in_(inicios))):
+            ocupadas.setdefault(slot_inicio, set()).add(vaga)
+
+        linhas = []
+        for inicio in inicios:
+            livres = [v for v in range(self.capacidade) if v not in ocupadas.get(inicio, ())]
+            if not livres: raise SlotIndisponivel(inicio)
+            linhas.append({"slot_inicio": inicio, "vaga": livres[0], "agendamento_id": agendamento_id})
+        conexao.execute(insert(ReservaSlot.__table__), linhas)
+
+    # Início (UTC) de cada slot da grade do dia local que o agendamento toca
+    def slots_da_reserva(self, data_hora_utc, duracao_minutos=None):
+        data_hora_utc = data_hora_utc.replace(tzinfo=None)
+        dia = pytz.utc.localize(data_hora_utc).astimezone(self.fuso).date()
+        abertura = self._inicio_dia_utc(dia) + timedelta(hours=self.hora_inicio)
+        primeiro, ultimo = self._indices_tocados((data_hora_utc - abertura).total_seconds() / 60, duracao_minutos)
+        return [abertura + timedelta(minutes=i * self.minutos_slot) for i in range(primeiro, ultimo)]
+
+    # Devolve as vagas de agendamentos que saíram da agenda (UPDATE em massa dos comandos de admin)
+    def liberar(self, agendamento_ids):
+        if not agendamento_ids: return
+        db.session.execute(delete(ReservaSlot.__table__).where(ReservaSlot.agendamento_id.in_(agendamento_ids)))
+
+    # Só ocupa a agenda (bitmap e ReservaSlot) o agendamento aberto que ainda não terminou.
+    # Concluídos, cancelados e o histórico ficam de fora, mesmo os lotados de antes das reservas
+    def ocupa_agenda(self, status, data_hora_utc, duracao_minutos=None, agora=None):
+        if status not in STATUS_ABERTOS: return False
+        fim = data_hora_utc.replace(tzinfo=None) + timedelta(minutes=duracao_minutos or self.minutos_slot)
+        return fim > (agora or agora_utc())
+
+    # Refaz as reservas de um agendamento a partir dele mesmo (a única fonte da verdade):
+    # apaga as antigas e reserva de novo se ele ainda ocupa a agenda
+    def sincronizar(self, conexao, agendamento):
+        conexao.execute(delete(ReservaSlot.__table__).where(ReservaSlot.agendamento_id == agendamento.id))
+        if agendamento.status not in STATUS_ABERTOS: return
+        duracao = conexao.execute(select(Servico.duracao_minutos).where(
+            Servico.id == agendamento.servico_id)).scalar()
+        if not self.ocupa_agenda(agendamento.status, agendamento.data_hora, duracao): return
+        self.reservar(conexao, agendamento.id, agendamento.data_hora, duracao)
+
+
+# Grade do negócio: expediente das 9h às 17h, slots de 1 hora, no fuso de São Paulo.
+# CAPACIDADE_POR_SLOT: atendimentos simultâneos no mesmo horário (equipes em campo).
+# O app e a migração 6 (que roda sem o app) montam o motor por aqui.
+def motor_padrao(fuso=None):
+    return MotorDisponibilidade(fuso or pytz.timezone('America/Sao_Paulo'), hora_inicio=9, hora_fim=17,
+                                minutos_slot=60, capacidade=int(os.environ.get("CAPACIDADE_POR_SLOT", 1)))
+
+
+# Criação, remarcação (data_hora), troca de serviço (duração), mudança de status e
+# remoção pelo ORM (bot e Flask-Admin) refazem as reservas no mesmo flush. Sem vaga, o
+# flush falha (SlotIndisponivel/IntegrityError) e a transação inteira é desfeita.
+# Registrado depois do hook de eventos (import acima), que pega a trava do log primeiro.
+CAMPOS_DA_AGENDA = ('data_hora', 'servico_id', 'status')
+
+@event.listens_for(Session, "after_flush")
+def _sincronizar_reservas(session, contexto_flush):
+    alterados = [ag for ag in session.new if isinstance(ag, Agendamento)]
+    alterados += [ag for ag in session.dirty if isinstance(ag, Agendamento) and any(
+        inspect(ag).attrs[campo].history.has_changes() for campo in CAMPOS_DA_AGENDA)]
+    removidos = [ag.id for ag in session.deleted if isinstance(ag, Agendamento)]
+    if not alterados and not removidos: return
+    motor = MotorDisponibilidade.ativo or motor_padrao()
+    conexao = session.connection()
+    # Sem FK em cascata no SQLite: as reservas de um agendamento apagado saem aqui
+    if removidos: conexao.execute(delete(ReservaSlot.__table__).where(ReservaSlot.agendamento_id.in_(removidos)))
+    for agendamento in alterados: motor.sincronizar(conexao, agendamento)
@@ -0,0 +1,203 @@
+import json
+import queue
+import threading
+
+from sqlalchemy import event, insert, inspect, select, text
+from sqlalchemy.orm import Session, joinedload
+
+from models import db, Agendamento, EventoAgendamento, Usuario
+
+
+# --- Registro das mudanças: gravado na mesma transação que altera o Agendamento ---
+def _tipo_do_evento(agendamento, novo):
+    if novo: return 'novo'
+    historico = inspect(agendamento).attrs.status.history
+    if historico.has_changes() and agendamento.status == 'Concluido': return 'concluido'
+    return 'atualizado'
+
+CAMPOS_DO_CLIENTE = ('nome', 'telefone')
+
+@event.listens_for(Session, "after_flush")
+def _registrar_eventos(session, contexto_flush):
+    linhas = [{"agendamento_id": ag.id, "tipo": _tipo_do_evento(ag, True)}
+              for ag in session.new if isinstance(ag, Agendamento)]
+    linhas += [{"agendamento_id": ag.id, "tipo": _tipo_do_evento(ag, False)}
+               for ag in session.dirty if isinstance(ag, Agendamento) and session.is_modified(ag)]
+    linhas += [{"agendamento_id": ag.id, "tipo": 'removido'}
+               for ag in session.deleted if isinstance(ag, Agendamento)]
+    # Nome e telefone do cliente aparecem em cada agendamento dele (listagens, ETag, ?since=, painel)
+    clientes = [u.id for u in session.dirty if isinstance(u, Usuario) and any(
+        inspect(u).attrs[campo].history.has_changes() for campo in CAMPOS_DO_CLIENTE)]
+    if clientes:
+        linhas += [{"agendamento_id": i, "tipo": 'atualizado'} for i in session.connection().execute(
+            select(Agendamento.id).where(Agendamento.usuario_id.in_(clientes))).scalars()]
+    _gravar(session, linhas)
+
+# Para UPDATEs em massa, que não passam pelo flush do ORM
+def registrar_eventos(session, agendamento_ids, tipo):
+    _gravar(session, [{"agendamento_id": i, "tipo": tipo} for i in agendamento_ids])
+
+# O id do evento é o cursor do SSE, do Last-Event-ID e do ?since=, então ele precisa ficar
+# visível na ordem do commit. No Postgres o id sai da sequence no flush: sem a trava, um
+# evento 10 commitado depois do 11 seria pulado por quem já leu o 11. A trava de transação
+# enfileira quem grava eventos (só o trecho final da transação, até o commit). No SQLite as
+# escritas já são serializadas pelo próprio banco.
+TRAVA_EVENTOS = 0x45564147  # chave do pg_advisory_xact_lock
+
+def _gravar(session, linhas):
+    if not linhas: return
+    conexao = session.connection()
+    if conexao.dialect.name == "postgresql":
+        conexao.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {"chave": TRAVA_EVENTOS})
+    conexao.execute(insert(EventoAgendamento.__table__), linhas)
+    session.info["eventos_pendentes"] = True
+
+@event.listens_for(Session, "after_commit")
+def _avisar_canal(session):
+    if session.info.pop("eventos_pendentes", False):
+        for canal in CanalEventos.instancias: canal.acordar()
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_aviso(session):
+    session.info.pop("eventos_pendentes", None)
+
+
+# --- Distribuição para os painéis conectados (SSE) ---
+class CanalEventos:
+    # Um único poller por worker lê o log de eventos e repassa para todas as conexões,
+    # então dezenas de telas abertas custam uma consulta indexada por intervalo.
+    instancias = []
+
+    def __init__(self, formatador, intervalo_poll=1.0, max_fila=1000, lote=200, max_conexoes=None):
+        self.formatador = formatador
+        # Cada painel prende uma thread do worker: acima de max_conexoes, abrir() recusa
+        self.max_conexoes = max_conexoes
+        self._vagas = threading.BoundedSemaphore(max_conexoes) if max_conexoes is not None else None
+        self.recusadas = 0
+        self.intervalo_poll = intervalo_poll
+        self.max_fila = max_fila
+        self.lote = lote
+        self.app = None
+        self._assinantes = set()
+        self._lock = threading.Lock()
+        self._evento = threading.Event()
+        self._thread = None
+        self._ultimo_id = None
+        CanalEventos.instancias.append(self)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['canal_eventos'] = self
+
+    def acordar(self):
+        self._evento.set()
+
+    # Vaga para mais um painel neste worker (False quando lotado); devolvida por fechar()
+    def abrir(self):
+        if self._vagas is None or self._vagas.acquire(blocking=False): return True
+        with self._lock: self.recusadas += 1
+        return False
+
+    def fechar(self):
+        if self._vagas is not None: self._vagas.release()
+
+    @property
+    def conectados(self):
+        return len(self._assinantes)
+
+    def ultimo_id(self):
+        return db.session.query(db.func.max(EventoAgendamento.id)).scalar() or 0
+
+    # Eventos com id > desde_id, já no formato enviado aos painéis
+    def carregar(self, desde_id, limite=None):
+        eventos = db.session.query(EventoAgendamento).filter(
+            EventoAgendamento.id > desde_id
+        ).order_by(EventoAgendamento.id).limit(limite or self.lote).all()
+        ids = {e.agendamento_id for e in eventos}
+        agendamentos = {}
+        if ids:
+            agendamentos = {ag.id: ag for ag in Agendamento.query.options(
+                joinedload(Agendamento.usuario), joinedload(Agendamento.servico)
+            ).filter(Agendamento.id.in_(ids))}
+        resultado = []
+        for e in eventos:
+            ag = agendamentos.get(e.agendamento_id)
+            dados = self.formatador(ag) if ag else {"id_agendamento": e.agendamento_id}
+            resultado.append((e.id, e.tipo, dados))
+        return resultado
+
+    def assinar(self):
+        fila = queue.Queue(maxsize=self.max_fila)
+        fila.atrasada = False
+        with self._lock:
+            self._assinantes.add(fila)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="canal-eventos", daemon=True)
+                self._thread.start()
+        self._evento.set()
+        return fila
+
+    def cancelar(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if not self._assinantes:
+                    self._thread = None; self._ultimo_id = None; return
+            try:
+                with self.app.app_context():
+                    if self._ultimo_id is None: self._ultimo_id = self.ultimo_id()
+                    eventos = self.carregar(self._ultimo_id)
+            except Exception as e:
+                print(f"Erro ao ler eventos de agendamento: {e}"); eventos = []
+            if eventos:
+                self._ultimo_id = eventos[-1][0]
+                with self._lock: assinantes = list(self._assinantes)
+                for fila in assinantes:
+                    for item in eventos:
+                        try: fila.put_nowait(item)
+                        except queue.Full:
+                            # Painel lento: ele se ressincroniza pelo banco em vez de perder eventos
+                            fila.atrasada = True; break
+            if len(eventos) < self.lote:
+                self._evento.wait(self.intervalo_poll)
+                self._evento.clear()
+
+    # Gerador do stream SSE. Sem Last-Event-ID, começa com um snapshot dos abertos.
+    def stream(self, desde_id, snapshot=None, keepalive=15):
+        fila = self.assinar()
+        try:
+            if desde_id is None:
+                desde_id = self.ultimo_id()
+                yield self._formatar(desde_id, 'snapshot', snapshot() if snapshot else [])
+            while True:
+                # Recupera o que foi perdido enquanto o painel esteve desconectado (ou lento)
+                fila.atrasada = False
+                while True:
+                    atrasados = self.carregar(desde_id)
+                    for item in atrasados:
+                        yield self._formatar(*item); desde_id = item[0]
+                    if len(atrasados) < self.lote: break
+                db.session.remove()
+                desde_id = yield from self._ao_vivo(fila, desde_id, keepalive)
+        finally:
+            self.cancelar(fila)
+
+    # Repassa os eventos da fila até ela ficar atrasada (então volta para o banco)
+    def _ao_vivo(self, fila, desde_id, keepalive):
+        while not fila.atrasada:
+            try:
+                evento_id, tipo, dados = fila.get(timeout=keepalive)
+            except queue.Empty:
+                yield ": ping\n\n"; continue
+            if evento_id <= desde_id: continue
+            desde_id = evento_id
+            yield self._formatar(evento_id, tipo, dados)
+        while not fila.empty(): fila.get_nowait()
+        return desde_id
+
+    @staticmethod
+    def _formatar(evento_id, tipo, dados):
+        return f"id: {evento_id}\nevent: {tipo}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
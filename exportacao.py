@@ -0,0 +1,150 @@
+"""Exportação em massa dos agendamentos (NDJSON ou CSV), em memória constante.
+
+Uso:
+    python exportacao.py --formato csv --de 01/01/2023 --ate 31/12/2024 --saida historico.csv
+    python exportacao.py --status Concluido > concluidos.ndjson
+    python exportacao.py --arquivo --de 01/01/2020 > arquivados.ndjson
+
+A mesma geração alimenta a rota /agendamentos/exportar.
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import pytz
+from sqlalchemy import select
+
+from models import db, ler_da_replica, Agendamento, AgendamentoArquivado, Usuario, Servico
+
+TAMANHO_LOTE = 1000
+FORMATOS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+COLUNAS_CSV = ["id_agendamento", "status", "data_agendamento", "hora_agendamento", "data_criacao_utc",
+               "atualizado_em_utc", "cliente_nome", "cliente_telefone", "servico_nome",
+               "endereco", "queixa", "btus", "marca"]
+
+
+class FiltroInvalido(ValueError):
+    pass
+
+
+# Filtros vindos da URL ou da linha de comando: datas locais dd/mm/aaaa (inclusivas), status
+# e de qual tabela ler (a viva ou o arquivo)
+class FiltrosExportacao:
+    def __init__(self, de=None, ate=None, status=None, arquivo=False):
+        self.de = de
+        self.ate = ate
+        self.status = status or []
+        self.arquivo = arquivo
+
+    @classmethod
+    def interpretar(cls, de=None, ate=None, status=None, arquivo=False):
+        try:
+            de = datetime.strptime(de, "%d/%m/%Y").date() if de else None
+            ate = datetime.strptime(ate, "%d/%m/%Y").date() if ate else None
+        except ValueError:
+            raise FiltroInvalido("Use datas no formato DD/MM/AAAA.")
+        if de and ate and de > ate: raise FiltroInvalido("A data inicial é depois da final.")
+        return cls(de, ate, [s.strip() for s in (status or "").split(",") if s.strip()], arquivo)
+
+
+class ExportadorAgendamentos:
+    def __init__(self, fuso, tamanho_lote=TAMANHO_LOTE):
+        self.fuso = fuso
+        self.tamanho_lote = tamanho_lote
+
+    def _inicio_dia_utc(self, dia):
+        meia_noite = self.fuso.localize(datetime(dia.year, dia.month, dia.day))
+        return meia_noite.astimezone(pytz.utc).replace(tzinfo=None)
+
+    def consulta(self, filtros):
+        # Só colunas (sem entidades nem relações preguiçosas) e um único JOIN
+        a = AgendamentoArquivado if filtros.arquivo else Agendamento
+        consulta = select(
+            a.id, a.status, a.data_hora, a.data_criacao, a.atualizado_em, a.endereco, a.queixa, a.btus,
+            a.marca, Usuario.nome, Usuario.telefone, Servico.nome, Servico.descricao
+        ).join(Usuario, a.usuario_id == Usuario.id).join(Servico, a.servico_id == Servico.id)
+        if filtros.de: consulta = consulta.where(a.data_hora >= self._inicio_dia_utc(filtros.de))
+        if filtros.ate: consulta = consulta.where(a.data_hora < self._inicio_dia_utc(filtros.ate + timedelta(days=1)))
+        if filtros.status: consulta = consulta.where(a.status.in_(filtros.status))
+        # yield_per liga o cursor do lado do servidor (stream_results) no Postgres
+        return consulta.order_by(a.data_hora, a.id).execution_options(yield_per=self.tamanho_lote)
+
+    def _conversor_local(self):
+        # Deslocamento do fuso calculado uma vez por hora UTC, não por linha
+        @lru_cache(maxsize=4096)
+        def deslocamento(hora_utc):
+            return pytz.utc.localize(hora_utc).astimezone(self.fuso).utcoffset()
+        def converter(data_hora):
+            return data_hora + deslocamento(data_hora.replace(minute=0, second=0, microsecond=0))
+        return converter
+
+    def lotes(self, filtros):
+        local = self._conversor_local()
+        for lote in db.session.execute(self.consulta(filtros)).partitions():
+            linhas = []
+            for (id_, status, data_hora, criacao, atualizacao, endereco, queixa, btus, marca,
+                 cliente, telefone, servico, descricao) in lote:
+                data_local = local(data_hora)
+                linhas.append({
+                    "id_agendamento": id_, "status": status,
+                    "data_agendamento": data_local.strftime('%d/%m/%Y'),
+                    "hora_agendamento": data_local.strftime('%H:%M'),
+                    "data_criacao_utc": criacao.isoformat() if criacao else None,
+                    "atualizado_em_utc": atualizacao.isoformat() if atualizacao else None,
+                    "cliente": {"nome": cliente, "telefone": telefone},
+                    "servico": {"nome": servico, "descricao": descricao},
+                    "detalhes": {"endereco": endereco, "queixa": queixa, "btus": btus, "marca": marca},
+                })
+            yield linhas
+
+    # Texto pronto para enviar, um pedaço por lote
+    def gerar(self, filtros, formato="ndjson"):
+        if formato == "csv": return self._gerar_csv(filtros)
+        return ("".join(json.dumps(l, ensure_ascii=False) + "\n" for l in linhas) for linhas in self.lotes(filtros))
+
+    def _gerar_csv(self, filtros):
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        escritor.writerow(COLUNAS_CSV)
+        yield buffer.getvalue()
+        for linhas in self.lotes(filtros):
+            buffer.seek(0); buffer.truncate()
+            for l in linhas:
+                escritor.writerow([
+                    l["id_agendamento"], l["status"], l["data_agendamento"], l["hora_agendamento"],
+                    l["data_criacao_utc"], l["atualizado_em_utc"], l["cliente"]["nome"], l["cliente"]["telefone"],
+                    l["servico"]["nome"], l["detalhes"]["endereco"], l["detalhes"]["queixa"],
+                    l["detalhes"]["btus"], l["detalhes"]["marca"]])
+            yield buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formato", choices=sorted(FORMATOS), default="ndjson")
+    parser.add_argument("--de", help="Data inicial (DD/MM/AAAA), inclusiva")
+    parser.add_argument("--ate", help="Data final (DD/MM/AAAA), inclusiva")
+    parser.add_argument("--status", help="Um ou mais status separados por vírgula")
+    parser.add_argument("--arquivo", action="store_true", help="Lê os agendamentos arquivados (manutencao.py)")
+    parser.add_argument("--saida", help="Arquivo de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    from app import create_app, exportador
+    try:
+        filtros = FiltrosExportacao.interpretar(args.de, args.ate, args.status, args.arquivo)
+    except FiltroInvalido as e:
+        parser.error(str(e))
+    saida = open(args.saida, "w", encoding="utf-8", newline="") if args.saida else sys.stdout
+    try:
+        with create_app(admin=False).app_context():
+            ler_da_replica()
+            for pedaco in exportador.gerar(filtros, args.formato): saida.write(pedaco)
+    finally:
+        if args.saida: saida.close()
+
+
+if __name__ == "__main__":
+    main()
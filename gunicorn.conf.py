@@ -0,0 +1,38 @@
+# Configuração do gunicorn (lida automaticamente de ./gunicorn.conf.py): gunicorn app:app
+#
+# Cada painel aberto em /agendamentos/eventos (SSE) segura uma conexão enquanto estiver
+# aberto. Com o worker "sync" padrão, cada conexão prende um processo inteiro e poucas
+# telas de parede deixariam o /bot sem worker. Com "gthread", cada conexão ocupa uma
+# thread, e o app aceita no máximo SSE_MAX_CONEXOES painéis por worker (o seguinte
+# recebe 503 e tenta de novo), para sobrar thread para o /bot.
+import os
+
+from config import dimensionar_threads
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+worker_class = "gthread"
+# Dimensionamento (config.dimensionar_threads): threads = painéis SSE por worker + /bot e
+# listagens. Ex.: 16 threads, SSE_MAX_CONEXOES=4 -> 4 painéis e 12 threads para o resto por
+# worker, das quais BOT_MAX_CONCORRENTES=10 para o /bot (o excedente recebe a mensagem de
+# "aguarde" na hora) e 2 para listagens, admin e /metrics; até GUNICORN_WORKERS x 4 painéis no total. Para mais telas de parede, suba
+# SSE_MAX_CONEXOES junto com GUNICORN_THREADS (ou os workers).
+# Ajuste por GUNICORN_THREADS (o app lê o mesmo valor), não por --threads.
+threads = dimensionar_threads()["threads"]
+# Com gthread o timeout vale para o worker parado, não para um stream longo
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+keepalive = 5
+# O app é montado no mestre; os filhos descartam as conexões herdadas (ver app.py)
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") != "0"
+# Recicla os workers aos poucos (memória)
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = 500
+
+
+# Falha na subida se o worker não for gthread ou se --threads divergir do GUNICORN_THREADS
+def on_starting(server):
+    if server.cfg.worker_class_str != "gthread":
+        raise RuntimeError(f"Worker {server.cfg.worker_class_str}: o SSE e o /bot precisam do gthread")
+    if server.cfg.threads != threads:
+        raise RuntimeError(f"--threads={server.cfg.threads} diverge de GUNICORN_THREADS={threads}, "
+                           "que o app usa para os tetos de SSE e /bot")
@@ -0,0 +1,33 @@
+from twilio.twiml.messaging_response import MessagingResponse
+
+
+# Deduplica os reenvios do webhook do Twilio pelo MessageSid.
+# O backend é qualquer cliente compatível com Redis (GET / SET ex= nx= / DELETE):
+# redis-py para compartilhar entre workers, ou RedisEmMemoria (limitado) por worker.
+class IdempotenciaMensagens:
+    PROCESSANDO = "__processando__"
+
+    def __init__(self, cliente, ttl_segundos=3600, ttl_processamento=60, prefixo="msg:"):
+        self.cliente = cliente
+        self.ttl_segundos = ttl_segundos
+        self.ttl_processamento = ttl_processamento
+        self.prefixo = prefixo
+        self.duplicadas = 0
+
+    # None: esta requisição deve processar a mensagem. Caso contrário, o TwiML a devolver.
+    def reservar(self, message_sid):
+        chave = self.prefixo + message_sid
+        if self.cliente.set(chave, self.PROCESSANDO, ex=self.ttl_processamento, nx=True): return None
+        self.duplicadas += 1
+        valor = self.cliente.get(chave)
+        if isinstance(valor, bytes): valor = valor.decode()
+        # Reenvio enquanto o original ainda está em andamento: responde vazio, sem reprocessar
+        if valor is None or valor == self.PROCESSANDO: return str(MessagingResponse())
+        return valor
+
+    def concluir(self, message_sid, resposta):
+        self.cliente.set(self.prefixo + message_sid, resposta, ex=self.ttl_segundos)
+
+    # Em caso de erro o reenvio do Twilio deve ser processado normalmente
+    def liberar(self, message_sid):
+        self.cliente.delete(self.prefixo + message_sid)
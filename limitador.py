@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from twilio.twiml.messaging_response import MessagingResponse
+
+
+# Balde de fichas por chave (telefone), em memória do worker. `capacidade` é a rajada
+# permitida e `taxa` as fichas repostas por segundo. Com max_chaves, os telefones
+# parados há mais tempo são descartados (voltam com o balde cheio).
+class BaldeMemoria:
+    def __init__(self, capacidade=10, taxa=1.0, max_chaves=10000):
+        self.capacidade = capacidade
+        self.taxa = taxa
+        self.max_chaves = max_chaves
+        self._baldes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def permitir(self, chave):
+        agora = time.monotonic()
+        with self._lock:
+            fichas, ultimo = self._baldes.pop(chave, (self.capacidade, agora))
+            fichas = min(self.capacidade, fichas + (agora - ultimo) * self.taxa)
+            permitido = fichas >= 1
+            self._baldes[chave] = (fichas - 1 if permitido else fichas, agora)
+            while len(self._baldes) > self.max_chaves: self._baldes.popitem(last=False)
+        return permitido
+
+
+# O mesmo balde num Redis compartilhado entre workers: um script Lua faz leitura,
+# reposição e consumo de forma atômica, com o relógio do próprio Redis.
+# A chave expira quando o balde estaria cheio de novo.
+_SCRIPT_BALDE = """
+local capacidade = tonumber(ARGV[1])
+local taxa = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local agora = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local balde = redis.call('HMGET', KEYS[1], 'fichas', 'ultimo')
+local fichas = tonumber(balde[1]) or capacidade
+local ultimo = tonumber(balde[2]) or agora
+fichas = math.min(capacidade, fichas + (agora - ultimo) * taxa)
+local permitido = 0
+if fichas >= 1 then fichas = fichas - 1; permitido = 1 end
+redis.call('HSET', KEYS[1], 'fichas', tostring(fichas), 'ultimo', tostring(agora))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacidade / taxa) + 1)
+return permitido
+"""
+
+class BaldeRedis:
+    def __init__(self, cliente, capacidade=10, taxa=1.0, prefixo="limite:"):
+        self.capacidade = capacidade
+        self.taxa = taxa
+        self.prefixo = prefixo
+        self._script = cliente.register_script(_SCRIPT_BALDE)
+
+    def permitir(self, chave):
+        return bool(self._script(keys=[self.prefixo + chave], args=[self.capacidade, self.taxa]))
+
+
+# Proteção do webhook: limite por telefone (balde) e teto de mensagens em processamento
+# no worker. Quem passa do limite recebe um TwiML pronto, sem tocar no banco.
+class LimitadorWebhook:
+    RESPOSTA_TELEFONE = "Recebemos muitas mensagens seguidas. Aguarde alguns segundos e tente de novo."
+    RESPOSTA_CONCORRENCIA = "Estamos com muitas mensagens agora. Tente de novo em instantes."
+
+    def __init__(self, balde, max_concorrentes=None):
+        self.balde = balde
+        self.max_concorrentes = max_concorrentes
+        self._vagas = threading.BoundedSemaphore(max_concorrentes) if max_concorrentes else None
+        self._em_andamento = 0
+        self._lock = threading.Lock()
+        self.rejeitadas = {"telefone": 0, "concorrencia": 0}
+        self._respostas = {motivo: self._twiml(texto) for motivo, texto in
+                           (("telefone", self.RESPOSTA_TELEFONE), ("concorrencia", self.RESPOSTA_CONCORRENCIA))}
+
+    @staticmethod
+    def _twiml(texto):
+        resposta = MessagingResponse()
+        resposta.message(texto)
+        return str(resposta)
+
+    def _rejeitar(self, motivo):
+        with self._lock: self.rejeitadas[motivo] += 1
+        return self._respostas[motivo]
+
+    @property
+    def em_andamento(self):
+        return self._em_andamento
+
+    # Uso: with limitador.entrar(telefone) as recusa: if recusa: return recusa
+    # `recusa` é None quando a mensagem pode ser processada, senão o TwiML a devolver.
+    @contextmanager
+    def entrar(self, telefone):
+        if not self.balde.permitir(telefone):
+            yield self._rejeitar("telefone"); return
+        if self._vagas is not None and not self._vagas.acquire(blocking=False):
+            yield self._rejeitar("concorrencia"); return
+        with self._lock: self._em_andamento += 1
+        try:
+            yield None
+        finally:
+            with self._lock: self._em_andamento -= 1
+            if self._vagas is not None: self._vagas.release()
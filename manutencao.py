@@ -0,0 +1,100 @@
+"""Manutenção periódica: varre sessões expiradas e arquiva agendamentos antigos.
+
+Uso (ex.: cron a cada 15 minutos):
+    python manutencao.py                     # sessões + arquivo (ARQUIVAR_APOS_DIAS, padrão 90)
+    python manutencao.py --idade-dias 180
+    python manutencao.py --so-sessoes
+    python manutencao.py --seco              # só conta o que seria feito
+    python manutencao.py --reenfileirar-notificacoes   # dead-letter de volta para a fila
+
+Tudo em comandos SQL por conjunto (sem carregar linhas no Python); o arquivo anda em
+lotes, um commit por lote, para não segurar locks na tabela quente.
+"""
+import argparse
+import os
+from datetime import timedelta
+
+from sqlalchemy import select, insert, delete, update, func, literal
+
+from models import db, agora_utc, Usuario, SessaoConversa, Agendamento, AgendamentoArquivado, ReservaSlot
+from eventos import registrar_eventos
+
+STATUS_ARQUIVAVEIS = ('Concluido', 'Cancelado')
+# Estados que não dependem do rascunho da sessão
+ESTADOS_SEM_RASCUNHO = ('menu_principal', 'aguardando_nome')
+COLUNAS_ARQUIVO = ['id', 'usuario_id', 'servico_id', 'data_hora', 'status', 'data_criacao',
+                   'atualizado_em', 'endereco', 'queixa', 'btus', 'marca']
+
+
+# Volta ao menu quem estava no meio de um agendamento com a sessão expirada e apaga os rascunhos
+def varrer_sessoes(agora=None, seco=False):
+    agora = agora or agora_utc()
+    expiradas = select(SessaoConversa.telefone).where(SessaoConversa.expira_em <= agora)
+    filtro_usuarios = (Usuario.telefone.in_(expiradas), Usuario.estado_atual.notin_(ESTADOS_SEM_RASCUNHO))
+    if seco:
+        return {
+            "sessoes": db.session.scalar(select(func.count()).select_from(expiradas.subquery())),
+            "usuarios": db.session.scalar(select(func.count(Usuario.id)).where(*filtro_usuarios)),
+        }
+    usuarios = db.session.execute(
+        update(Usuario.__table__).where(*filtro_usuarios).values(estado_atual='menu_principal')).rowcount
+    # expira_em é conferido de novo: uma sessão renovada no meio tempo não é apagada
+    sessoes = db.session.execute(
+        delete(SessaoConversa.__table__).where(SessaoConversa.expira_em <= agora)).rowcount
+    db.session.commit()
+    return {"sessoes": sessoes, "usuarios": usuarios}
+
+
+# Move concluídos/cancelados com data_hora anterior a `antes_de` para agendamento_arquivado
+def arquivar_agendamentos(antes_de, lote=1000, seco=False):
+    candidatos = select(Agendamento.id).where(
+        Agendamento.status.in_(STATUS_ARQUIVAVEIS), Agendamento.data_hora < antes_de)
+    if seco:
+        return {"agendamentos": db.session.scalar(select(func.count()).select_from(candidatos.subquery()))}
+
+    total = 0
+    while True:
+        ids = db.session.execute(candidatos.order_by(Agendamento.id).limit(lote)).scalars().all()
+        if not ids: break
+        colunas = [getattr(Agendamento.__table__.c, c) for c in COLUNAS_ARQUIVO]
+        db.session.execute(insert(AgendamentoArquivado.__table__).from_select(
+            COLUNAS_ARQUIVO + ['arquivado_em'],
+            select(*colunas, literal(agora_utc())).where(Agendamento.id.in_(ids))))
+        db.session.execute(delete(ReservaSlot.__table__).where(ReservaSlot.agendamento_id.in_(ids)))
+        # O painel e o feed ?since= tiram esses agendamentos da listagem (o ETag também muda)
+        registrar_eventos(db.session, ids, 'arquivado')
+        db.session.execute(delete(Agendamento.__table__).where(Agendamento.id.in_(ids)))
+        db.session.commit()
+        total += len(ids)
+    return {"agendamentos": total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--idade-dias", type=int, default=int(os.environ.get("ARQUIVAR_APOS_DIAS", 90)),
+                        help="Arquiva concluídos/cancelados com data anterior a N dias")
+    parser.add_argument("--lote", type=int, default=1000)
+    parser.add_argument("--so-sessoes", action="store_true")
+    parser.add_argument("--so-arquivo", action="store_true")
+    parser.add_argument("--seco", action="store_true", help="Só conta, sem alterar nada")
+    parser.add_argument("--reenfileirar-notificacoes", action="store_true",
+                        help="Só devolve as notificações que esgotaram as tentativas para a fila")
+    args = parser.parse_args()
+
+    from app import create_app, sessoes, fila_notificacoes
+    with create_app(admin=False).app_context():
+        if args.reenfileirar_notificacoes:
+            print("Notificações reenfileiradas:", fila_notificacoes.reenfileirar_falhas())
+            return
+        if not args.so_arquivo:
+            if getattr(sessoes, "transacional", False):
+                print("Sessões:", varrer_sessoes(seco=args.seco))
+            else:
+                print("Sessões: backend com TTL nativo (Redis), nada a varrer.")
+        if not args.so_sessoes:
+            antes_de = agora_utc() - timedelta(days=args.idade_dias)
+            print("Arquivo:", arquivar_agendamentos(antes_de, args.lote, args.seco))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+# Conta as consultas SQL feitas durante a medição ativa desta thread
+@event.listens_for(Engine, "before_cursor_execute")
+def _contar_consulta(conn, cursor, statement, parameters, context, executemany):
+    medicao = getattr(_local, "medicao", None)
+    if medicao is not None: medicao.consultas += 1
+
+
+# Dados de uma mensagem recebida, passados para o handler do estado
+class Contexto:
+    def __init__(self, usuario, sessao, mensagem, resposta):
+        self.usuario = usuario
+        self.sessao = sessao
+        self.mensagem = mensagem
+        self.resposta = resposta
+
+
+class Medicao:
+    def __init__(self):
+        self.estado = None
+        self.transicao = None
+        self.consultas = 0
+        self.erro = False
+        self.inicio = time.perf_counter()
+
+
+class Estatistica:
+    def __init__(self):
+        self.contagem = 0
+        self.erros = 0
+        self.tempo_total = 0.0
+        self.tempo_max = 0.0
+        self.consultas_total = 0
+        self.latencias = deque(maxlen=1000)
+
+    def registrar(self, duracao, consultas, erro):
+        self.contagem += 1
+        self.erros += int(erro)
+        self.tempo_total += duracao
+        self.tempo_max = max(self.tempo_max, duracao)
+        self.consultas_total += consultas
+        self.latencias.append(duracao)
+
+    def resumo(self):
+        ordenadas = sorted(self.latencias)
+        def percentil(p): return round(ordenadas[min(len(ordenadas) - 1, int(p * len(ordenadas)))] * 1000, 3) if ordenadas else 0
+        return {
+            "contagem": self.contagem,
+            "erros": self.erros,
+            "taxa_erro": round(self.erros / self.contagem, 4) if self.contagem else 0,
+            "latencia_media_ms": round(self.tempo_total / self.contagem * 1000, 3) if self.contagem else 0,
+            "latencia_p50_ms": percentil(0.50),
+            "latencia_p95_ms": percentil(0.95),
+            "latencia_max_ms": round(self.tempo_max * 1000, 3),
+            "consultas_media": round(self.consultas_total / self.contagem, 2) if self.contagem else 0,
+        }
+
+
+class MaquinaEstados:
+    def __init__(self):
+        self.handlers = {}
+        self.padrao = None
+        self._por_estado = {}
+        self._por_transicao = {}
+        self._lock = threading.Lock()
+
+    # Decorador: @maquina.estado("menu_principal")
+    def estado(self, *nomes):
+        def registrar(handler):
+            for nome in nomes: self.handlers[nome] = handler
+            return handler
+        return registrar
+
+    # Handler usado quando o estado não está na tabela
+    def estado_padrao(self, handler):
+        self.padrao = handler
+        return handler
+
+    def despachar(self, estado, ctx):
+        self.marcar(estado)
+        origem = ctx.usuario.estado_atual
+        handler = self.handlers.get(estado, self.padrao)
+        resultado = handler(ctx)
+        medicao = getattr(_local, "medicao", None)
+        if medicao is not None: medicao.transicao = f"{origem}->{ctx.usuario.estado_atual}"
+        return resultado
+
+    # Atribui a mensagem atual a um estado (ou pseudo-estado: novo_usuario, timeout, admin)
+    def marcar(self, estado):
+        medicao = getattr(_local, "medicao", None)
+        if medicao is not None: medicao.estado = estado
+
+    def marcar_erro(self):
+        medicao = getattr(_local, "medicao", None)
+        if medicao is not None: medicao.erro = True
+
+    # Mede a mensagem inteira (consulta, handler e commit) e atribui ao estado marcado
+    @contextmanager
+    def medir(self):
+        anterior = getattr(_local, "medicao", None)
+        medicao = _local.medicao = Medicao()
+        try:
+            yield medicao
+        except Exception:
+            medicao.erro = True; raise
+        finally:
+            _local.medicao = anterior
+            self._registrar(medicao, time.perf_counter() - medicao.inicio)
+
+    def _registrar(self, medicao, duracao):
+        with self._lock:
+            chave = medicao.estado or "desconhecido"
+            self._por_estado.setdefault(chave, Estatistica()).registrar(duracao, medicao.consultas, medicao.erro)
+            if medicao.transicao:
+                self._por_transicao.setdefault(medicao.transicao, Estatistica()).registrar(duracao, medicao.consultas, medicao.erro)
+
+    # (mensagens, erros) por estado, sem calcular percentis (para o /metrics)
+    def contagens(self):
+        with self._lock:
+            return {nome: (e.contagem, e.erros) for nome, e in self._por_estado.items()}
+
+    def resumo(self):
+        with self._lock:
+            return {
+                "estados": {nome: e.resumo() for nome, e in self._por_estado.items()},
+                "transicoes": {nome: e.resumo() for nome, e in self._por_transicao.items()},
+            }
@@ -0,0 +1,199 @@
+import threading
+import time
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_CONSULTAS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _formatar_rotulos(nomes, valores, extra=()):
+    pares = list(zip(nomes, valores)) + list(extra)
+    if not pares: return ""
+    return "{" + ",".join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + "}"
+
+def _numero(valor):
+    if valor == float("inf"): return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+# --- Tipos de métrica (formato de texto do Prometheus, sem dependência externa) ---
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        # Sem rótulos, a série existe desde o início (valendo 0)
+        self._valores = {} if self.rotulos else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **rotulos):
+        chave = tuple(rotulos.get(r, "") for r in self.rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def amostras(self):
+        with self._lock: valores = dict(self._valores)
+        return [(self.nome, _formatar_rotulos(self.rotulos, chave), valor) for chave, valor in sorted(valores.items())]
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_SEGUNDOS):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **rotulos):
+        chave = tuple(rotulos.get(r, "") for r in self.rotulos)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None: serie = self._series[chave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite: serie[0][i] += 1; break
+            serie[1] += valor
+            serie[2] += 1
+
+    def amostras(self):
+        with self._lock: series = {chave: (list(c), s, n) for chave, (c, s, n) in self._series.items()}
+        resultado = []
+        for chave, (contagens, soma, total) in sorted(series.items()):
+            acumulado = 0
+            for limite, contagem in zip(self.buckets, contagens):
+                acumulado += contagem
+                resultado.append((self.nome + "_bucket", _formatar_rotulos(self.rotulos, chave, [("le", _numero(limite))]), acumulado))
+            resultado.append((self.nome + "_sum", _formatar_rotulos(self.rotulos, chave), soma))
+            resultado.append((self.nome + "_count", _formatar_rotulos(self.rotulos, chave), total))
+        return resultado
+
+
+# Valor lido na hora da coleta (tamanho de fila, conversas ativas, contadores de outros módulos).
+# `funcao` retorna um número ou uma lista de (dict de rótulos, valor).
+class Coletor:
+    def __init__(self, nome, ajuda, funcao, tipo="gauge", rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+        self.tipo = tipo
+        self.rotulos = tuple(rotulos)
+
+    def amostras(self):
+        valores = self.funcao()
+        if not isinstance(valores, (list, tuple)): valores = [({}, valores)]
+        return [(self.nome, _formatar_rotulos(self.rotulos, tuple(r.get(n, "") for n in self.rotulos)), v)
+                for r, v in valores]
+
+
+class RegistroMetricas:
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            return self._metricas.setdefault(metrica.nome, metrica)
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(nome, ajuda, rotulos))
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_SEGUNDOS):
+        return self._registrar(Histograma(nome, ajuda, rotulos, buckets))
+
+    def coletor(self, nome, ajuda, funcao, tipo="gauge", rotulos=()):
+        return self._registrar(Coletor(nome, ajuda, funcao, tipo, rotulos))
+
+    def exportar(self):
+        with self._lock: metricas = list(self._metricas.values())
+        linhas = []
+        for metrica in metricas:
+            try:
+                amostras = metrica.amostras()
+            except Exception as e:
+                print(f"Erro ao coletar a métrica {metrica.nome}: {e}"); continue
+            linhas.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            linhas += [f"{nome}{rotulos} {_numero(valor)}" for nome, rotulos, valor in amostras]
+        return "\n".join(linhas) + "\n"
+
+
+# Registro do processo (cada worker do gunicorn tem o seu)
+registro = RegistroMetricas()
+
+SQL_CONSULTAS = registro.contador("sql_consultas_total", "Comandos SQL executados (inclui threads de fundo).")
+SQL_DURACAO = registro.contador("sql_duracao_segundos_total", "Tempo total gasto em comandos SQL.")
+
+
+# --- SQL: tempo de cada comando, acumulado também na requisição corrente da thread ---
+_local = threading.local()
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _inicio_consulta(conn, cursor, statement, parameters, context, executemany):
+    # No contexto da execução, não na conexão: um comando que falha (IntegrityError do
+    # conflito de vaga) não chama o after_cursor_execute e o início morre junto com o contexto
+    if context is not None: context._metricas_inicio = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _fim_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicio = getattr(context, "_metricas_inicio", None)
+    if inicio is None: return
+    duracao = time.perf_counter() - inicio
+    SQL_CONSULTAS.inc()
+    SQL_DURACAO.inc(duracao)
+    acumulado = getattr(_local, "requisicao", None)
+    if acumulado is not None:
+        acumulado[0] += 1; acumulado[1] += duracao
+
+
+# --- Flask: latência, status e SQL por endpoint ---
+class MetricasHTTP:
+    def __init__(self, ignorar=("static",)):
+        # Endpoints fora da medição (o próprio /metrics, streams de longa duração...)
+        self.ignorar = set(ignorar)
+        self.requisicoes = registro.contador(
+            "http_requisicoes_total", "Requisições HTTP por endpoint, método e status.", ("endpoint", "metodo", "status"))
+        self.duracao = registro.histograma(
+            "http_requisicao_duracao_segundos", "Latência das requisições HTTP (inclui o streaming da resposta).", ("endpoint",))
+        self.consultas = registro.histograma(
+            "sql_consultas_por_requisicao", "Comandos SQL por requisição.", ("endpoint",), BUCKETS_CONSULTAS)
+        self.duracao_sql = registro.histograma(
+            "sql_duracao_por_requisicao_segundos", "Tempo em SQL por requisição.", ("endpoint",))
+
+    def init_app(self, app):
+        app.before_request(self._inicio)
+        app.after_request(self._resposta)
+        # teardown roda depois do streaming (stream_with_context mantém o contexto até o fim)
+        app.teardown_request(self._fim)
+        app.extensions['metricas_http'] = self
+
+    def _inicio(self):
+        if request.endpoint in self.ignorar: return
+        g.metricas_inicio = time.perf_counter()
+        _local.requisicao = [0, 0.0]
+
+    def _resposta(self, resposta):
+        g.metricas_status = resposta.status_code
+        return resposta
+
+    def _fim(self, erro=None):
+        inicio = g.pop("metricas_inicio", None)
+        acumulado = getattr(_local, "requisicao", None)
+        _local.requisicao = None
+        if inicio is None: return
+        endpoint = request.endpoint or "404"
+        status = 500 if erro is not None else g.pop("metricas_status", 500)
+        self.requisicoes.inc(endpoint=endpoint, metodo=request.method, status=status)
+        self.duracao.observar(time.perf_counter() - inicio, endpoint=endpoint)
+        if acumulado is not None:
+            self.consultas.observar(acumulado[0], endpoint=endpoint)
+            self.duracao_sql.observar(acumulado[1], endpoint=endpoint)
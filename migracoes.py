@@ -0,0 +1,218 @@
+"""Migrações versionadas do banco.
+
+Uso:
+    python migracoes.py            # aplica as migrações pendentes
+    python migracoes.py --listar   # mostra a versão atual e as migrações conhecidas
+
+Cada migração roda na sua própria transação e é idempotente (confere o que já
+existe antes de criar), então bancos antigos criados por db.create_all() entram
+na versão 0 e sobem normalmente.
+"""
+import argparse
+from datetime import datetime
+
+import pytz
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData, String, Table, delete, exists, inspect,
+                        select, text)
+
+from models import (db, Agendamento, AgendamentoArquivado, Usuario, Servico, SessaoConversa, VersaoCatalogo,
+                    ReservaSlot, EventoAgendamento, NotificacaoPendente, VersaoSchema, STATUS_ABERTOS)
+
+MIGRACOES = []
+
+
+def migracao(versao, descricao):
+    def registrar(funcao):
+        MIGRACOES.append((versao, descricao, funcao))
+        MIGRACOES.sort(key=lambda m: m[0])
+        return funcao
+    return registrar
+
+
+def _colunas(conexao, tabela):
+    return {c["name"] for c in inspect(conexao).get_columns(tabela)}
+
+
+def _adicionar_coluna(conexao, tabela, coluna):
+    if coluna.name in _colunas(conexao, tabela): return False
+    tipo = coluna.type.compile(dialect=conexao.dialect)
+    conexao.execute(text(f"ALTER TABLE {tabela} ADD COLUMN {coluna.name} {tipo}"))
+    return True
+
+
+def _criar_indices(conexao, tabela):
+    for indice in sorted(tabela.indexes, key=lambda i: i.name):
+        indice.create(conexao, checkfirst=True)
+
+
+# Esquema do baseline (o que o creat_db.py criava), congelado: um banco novo passa pelas
+# mesmas migrações que um antigo e os dois terminam iguais
+_BASELINE = MetaData()
+Table("user", _BASELINE,
+      Column("id", Integer, primary_key=True),
+      Column("username", String(80), unique=True, nullable=False),
+      Column("password_hash", String(600), nullable=False))
+Table("usuario", _BASELINE,
+      Column("id", Integer, primary_key=True),
+      Column("telefone", String(20), unique=True, nullable=False),
+      Column("nome", String(100)),
+      Column("estado_atual", String(50)),
+      Column("temp_servico_id", Integer),
+      Column("temp_data", String(10)),
+      Column("temp_endereco", String(200)),
+      Column("temp_queixa", String(500)),
+      Column("temp_btus", String(50)),
+      Column("temp_marca", String(100)),
+      Column("last_interaction_time", DateTime))
+Table("servico", _BASELINE,
+      Column("id", Integer, primary_key=True),
+      Column("nome", String(100), nullable=False),
+      Column("descricao", String(500)),
+      Column("duracao_minutos", Integer))
+Table("agendamento", _BASELINE,
+      Column("id", Integer, primary_key=True),
+      Column("usuario_id", Integer, ForeignKey("usuario.id"), nullable=False),
+      Column("servico_id", Integer, ForeignKey("servico.id"), nullable=False),
+      Column("data_hora", DateTime, nullable=False),
+      Column("status", String(20)),
+      Column("data_criacao", DateTime),
+      Column("endereco", String(200)),
+      Column("queixa", String(500)),
+      Column("btus", String(50)),
+      Column("marca", String(100)))
+
+# Tabelas auxiliares, criadas pelo modelo (as migrações seguintes só conferem os índices). Quando uma
+# migração alterar alguma, a definição dela é congelada aqui como as do baseline
+_TABELAS_AUXILIARES = (SessaoConversa, VersaoCatalogo, ReservaSlot, EventoAgendamento, NotificacaoPendente)
+
+
+@migracao(1, "tabelas iniciais")
+def _tabelas_iniciais(conexao):
+    # Só cria as tabelas que faltam; as existentes ficam para as migrações seguintes
+    _BASELINE.create_all(conexao)
+    for modelo in _TABELAS_AUXILIARES: modelo.__table__.create(conexao, checkfirst=True)
+
+
+@migracao(2, "agendamento.atualizado_em")
+def _atualizado_em(conexao):
+    if _adicionar_coluna(conexao, "agendamento", Agendamento.__table__.c.atualizado_em):
+        conexao.execute(text("UPDATE agendamento SET atualizado_em = data_criacao"))
+
+
+@migracao(3, "índices das consultas quentes")
+def _indices(conexao):
+    for modelo in (Agendamento, Usuario, NotificacaoPendente):
+        _criar_indices(conexao, modelo.__table__)
+
+
+@migracao(4, "tabela de agendamentos arquivados")
+def _arquivo(conexao):
+    AgendamentoArquivado.__table__.create(conexao, checkfirst=True)
+
+
+@migracao(5, "busca do admin por nome (trigramas, só Postgres)")
+def _busca_nome(conexao):
+    # ILIKE '%texto%' no nome usa o índice GIN de trigramas; no SQLite a busca por nome
+    # continua varrendo usuario (a por telefone já usa o índice único, como prefixo)
+    if conexao.dialect.name != "postgresql": return
+    conexao.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    conexao.execute(text("CREATE INDEX IF NOT EXISTS ix_usuario_nome_trgm ON usuario USING gin (nome gin_trgm_ops)"))
+
+
+@migracao(6, "reservas dos agendamentos abertos anteriores ao ReservaSlot")
+def _reservas_abertas(conexao):
+    # Recria pelo mesmo caminho do hook de flush, com a grade padrão (capacidade do .env),
+    # com ou sem o app importado
+    from disponibilidade import MotorDisponibilidade, SlotIndisponivel, motor_padrao
+    motor = MotorDisponibilidade.ativo or motor_padrao()
+    sem_reserva = select(Agendamento.id, Agendamento.status, Agendamento.data_hora, Servico.duracao_minutos).join(
+        Servico, Agendamento.servico_id == Servico.id
+    ).where(
+        Agendamento.status.in_(STATUS_ABERTOS),
+        ~exists().where(ReservaSlot.agendamento_id == Agendamento.id)
+    ).order_by(Agendamento.data_hora, Agendamento.id)
+    agora = datetime.now(pytz.utc).replace(tzinfo=None)
+    for agendamento_id, status, data_hora, duracao in conexao.execute(sem_reserva).all():
+        # Os que já passaram não ocupam mais a agenda (a mesma regra do hook de flush)
+        if not motor.ocupa_agenda(status, data_hora, duracao, agora): continue
+        try:
+            motor.reservar(conexao, agendamento_id, data_hora, duracao)
+        except SlotIndisponivel as e:
+            # Horário já lotado antes do ReservaSlot existir: fica registrado, sem bloquear a migração
+            print(f"Agendamento {agendamento_id} sem vaga livre em {e}; confira no admin.")
+
+
+@migracao(7, "reservas alinhadas à grade de slots")
+def _reservas_na_grade(conexao):
+    # Horários fora da grade (09:30) reservavam o próprio horário e não os slots que tocam:
+    # refaz as reservas de todos os abertos pelo caminho da migração 6
+    abertos = select(Agendamento.id).where(Agendamento.status.in_(STATUS_ABERTOS))
+    conexao.execute(delete(ReservaSlot.__table__).where(ReservaSlot.agendamento_id.in_(abertos)))
+    _reservas_abertas(conexao)
+
+
+# Rascunho do agendamento que ficava em usuario antes de SessaoConversa/Redis
+COLUNAS_RASCUNHO_ANTIGAS = ('temp_servico_id', 'temp_data', 'temp_endereco', 'temp_queixa', 'temp_btus', 'temp_marca')
+
+@migracao(8, "remove o rascunho antigo (temp_*) de usuario")
+def _rascunho_antigo(conexao):
+    colunas = [c for c in COLUNAS_RASCUNHO_ANTIGAS if c in _colunas(conexao, "usuario")]
+    if not colunas: return
+    # DROP COLUMN: Postgres e SQLite >= 3.35. Num SQLite mais antigo as colunas ficam, mas vazias
+    if conexao.dialect.name == "sqlite" and conexao.dialect.dbapi.sqlite_version_info < (3, 35):
+        conexao.execute(text(f"UPDATE usuario SET {', '.join(f'{c} = NULL' for c in colunas)}"))
+        print(f"SQLite {conexao.dialect.dbapi.sqlite_version}: colunas {', '.join(colunas)} esvaziadas, não removidas.")
+        return
+    for coluna in colunas:
+        conexao.execute(text(f"ALTER TABLE usuario DROP COLUMN {coluna}"))
+
+
+def versao_atual(conexao):
+    VersaoSchema.__table__.create(conexao, checkfirst=True)
+    return conexao.execute(text("SELECT versao FROM versao_schema WHERE id = 1")).scalar() or 0
+
+
+def _gravar_versao(conexao, versao):
+    agora = datetime.now(pytz.utc).replace(tzinfo=None)
+    atualizadas = conexao.execute(text("UPDATE versao_schema SET versao = :v, aplicada_em = :a WHERE id = 1"),
+                                  {"v": versao, "a": agora}).rowcount
+    if not atualizadas:
+        conexao.execute(text("INSERT INTO versao_schema (id, versao, aplicada_em) VALUES (1, :v, :a)"),
+                        {"v": versao, "a": agora})
+
+
+# Aplica as migrações pendentes (até `alvo`); retorna as versões aplicadas
+def migrar(engine=None, alvo=None):
+    engine = engine or db.engine
+    with engine.begin() as conexao:
+        atual = versao_atual(conexao)
+    aplicadas = []
+    for versao, descricao, funcao in MIGRACOES:
+        if versao <= atual or (alvo is not None and versao > alvo): continue
+        with engine.begin() as conexao:
+            funcao(conexao)
+            _gravar_versao(conexao, versao)
+        print(f"Migração {versao} aplicada: {descricao}")
+        aplicadas.append(versao)
+    return aplicadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listar", action="store_true", help="Só mostra a versão atual e as migrações")
+    parser.add_argument("--alvo", type=int, help="Para nesta versão")
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app(admin=False)
+    with app.app_context():
+        if args.listar:
+            with db.engine.begin() as conexao: atual = versao_atual(conexao)
+            for versao, descricao, _ in MIGRACOES:
+                print(f"{'x' if versao <= atual else ' '} {versao:>3}  {descricao}")
+            return
+        if not migrar(alvo=args.alvo): print("Banco já está na versão mais recente.")
+
+
+if __name__ == "__main__":
+    main()
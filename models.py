@@ -1,8 +1,37 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from flask_login import UserMixin
+from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import pytz 
 
-db = SQLAlchemy()
+# Sessão que manda as leituras para a bind "replica" quando a requisição pediu
+# (ler_da_replica) e a réplica está configurada. Flush (escrita) vai sempre para o primário.
+class SessaoRoteada(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get("replica") and not self._flushing:
+            replica = self._db.engines.get("replica")
+            if replica is not None: return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(session_options={"class_": SessaoRoteada})
+
+# Marca a sessão da requisição atual como somente leitura: até o fim do app context
+# (inclusive respostas em streaming) as consultas vão para a réplica, se houver
+def ler_da_replica():
+    db.session.info["replica"] = True
+
+# Agora em UTC "naive", o formato que as colunas DateTime guardam
+def agora_utc():
+    return datetime.now(pytz.utc).replace(tzinfo=None)
+
+# Login do painel admin
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    password_hash = db.Column(db.String(600), nullable=False)
+    def set_password(self, password): self.password_hash = generate_password_hash(password)
+    def check_password(self, password): return check_password_hash(self.password_hash, password)
 
 class Usuario(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -10,18 +39,10 @@ class Usuario(db.Model):
     nome = db.Column(db.String(100))
     estado_atual = db.Column(db.String(50), default='inicio')
     
-    # Campos temporários de agendamento
-    temp_servico_id = db.Column(db.Integer)
-    temp_data = db.Column(db.String(10))
-    
-    # Campos temporários do esboço
-    temp_endereco = db.Column(db.String(200))
-    temp_queixa = db.Column(db.String(500))
-    temp_btus = db.Column(db.String(50))
-    temp_marca = db.Column(db.String(100))
+    # O rascunho do agendamento fica em SessaoConversa (ou no Redis), não aqui
 
-    # Campo de Timeout
-    last_interaction_time = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc))
+    # Última interação (informativo: o timeout agora é o TTL da sessão)
+    last_interaction_time = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc), index=True)
 
     # --- [MODIFICADO] Relação explícita ---
     agendamentos = db.relationship('Agendamento', back_populates='usuario', lazy=True)
@@ -35,15 +56,50 @@ class Servico(db.Model):
     # --- [MODIFICADO] Relação explícita ---
     agendamentos = db.relationship('Agendamento', back_populates='servico', lazy=True)
 
+# Sessão da conversa: rascunho do agendamento com expiração (TTL)
+class SessaoConversa(db.Model):
+    telefone = db.Column(db.String(20), primary_key=True)
+    dados = db.Column(db.Text)
+    expira_em = db.Column(db.DateTime, nullable=False, index=True)
+
+# Versão do catálogo de serviços: incrementada pelo admin para invalidar o cache dos workers
+class VersaoCatalogo(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    versao = db.Column(db.Integer, default=0, nullable=False)
+
+# Última migração aplicada ao banco (migracoes.py)
+class VersaoSchema(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    versao = db.Column(db.Integer, default=0, nullable=False)
+    aplicada_em = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc))
+
+# Status em aberto (listagem /agendamentos/abertos e painel)
+STATUS_ABERTOS = ('Aberto', 'Confirmado')
+_FILTRO_ABERTOS = "status IN ('Aberto', 'Confirmado')"
+
 class Agendamento(db.Model):
+    # Índices criados pela migração 3 (migracoes.py); a verificação dos planos está em verificar_planos.py
+    __table_args__ = (
+        # Listagens por status ordenadas por (data_hora, id) e filtros do admin
+        db.Index('ix_agendamento_status_data_hora', 'status', 'data_hora', 'id'),
+        # Varredura de um intervalo de dias na disponibilidade
+        db.Index('ix_agendamento_data_hora', 'data_hora'),
+        # Parcial: só as linhas em aberto, já na ordem da listagem
+        db.Index('ix_agendamento_abertos', 'data_hora', 'id',
+                 postgresql_where=db.text(_FILTRO_ABERTOS), sqlite_where=db.text(_FILTRO_ABERTOS)),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False, index=True)
     servico_id = db.Column(db.Integer, db.ForeignKey('servico.id'), nullable=False)
     
     data_hora = db.Column(db.DateTime, nullable=False) 
     status = db.Column(db.String(20), default='Aberto')
     
     data_criacao = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc))
+    # Última alteração (o cursor ?since= das listagens usa o id do EventoAgendamento)
+    atualizado_em = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc),
+                              onupdate=lambda: datetime.now(pytz.utc))
     
     # Campos permanentes do esboço
     endereco = db.Column(db.String(200))
@@ -54,4 +110,67 @@ class Agendamento(db.Model):
     # --- [ADICIONADO] Relações explícitas ---
     # Isso corrige o erro do Flask-Admin
     usuario = db.relationship('Usuario', back_populates='agendamentos')
-    servico = db.relationship('Servico', back_populates='agendamentos')
\ No newline at end of file
+    servico = db.relationship('Servico', back_populates='agendamentos')
+
+# Agendamentos concluídos/cancelados antigos, movidos pelo manutencao.py para fora da tabela quente.
+# Mesmas colunas (e o mesmo id) do Agendamento; lido sob demanda com ?arquivo=1.
+class AgendamentoArquivado(db.Model):
+    __table_args__ = (
+        db.Index('ix_agendamento_arquivado_status_data_hora', 'status', 'data_hora', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False, index=True)
+    servico_id = db.Column(db.Integer, db.ForeignKey('servico.id'), nullable=False)
+    data_hora = db.Column(db.DateTime, nullable=False)
+    status = db.Column(db.String(20))
+    data_criacao = db.Column(db.DateTime)
+    atualizado_em = db.Column(db.DateTime)
+    endereco = db.Column(db.String(200))
+    queixa = db.Column(db.String(500))
+    btus = db.Column(db.String(50))
+    marca = db.Column(db.String(100))
+    arquivado_em = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc))
+
+    usuario = db.relationship('Usuario')
+    servico = db.relationship('Servico')
+
+# Ocupação de cada slot do expediente. A unicidade (slot_inicio, vaga) é a garantia,
+# no banco, de que dois workers não reservam a mesma vaga do mesmo horário.
+class ReservaSlot(db.Model):
+    __table_args__ = (db.UniqueConstraint('slot_inicio', 'vaga', name='uq_reserva_slot_vaga'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    slot_inicio = db.Column(db.DateTime, nullable=False)
+    vaga = db.Column(db.Integer, nullable=False, default=0)
+    agendamento_id = db.Column(db.Integer, db.ForeignKey('agendamento.id', ondelete='CASCADE'), nullable=False, index=True)
+
+# Log de mudanças dos agendamentos (alimenta o painel via SSE); o id é o Last-Event-ID
+class EventoAgendamento(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    agendamento_id = db.Column(db.Integer, nullable=False)
+    tipo = db.Column(db.String(20), nullable=False)  # 'novo', 'atualizado', 'concluido', 'removido', 'arquivado'
+    data_criacao = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc))
+
+# --- Fila persistente de notificações para os admins ---
+_FILTRO_FILA = "status IN ('pendente', 'enviando')"
+
+class NotificacaoPendente(db.Model):
+    # Parcial: o worker só procura as vencidas entre as pendentes/em envio
+    __table_args__ = (
+        db.Index('ix_notificacao_pendente_fila', 'proxima_tentativa',
+                 postgresql_where=db.text(_FILTRO_FILA), sqlite_where=db.text(_FILTRO_FILA)),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    destino = db.Column(db.String(50), nullable=False)
+    corpo = db.Column(db.Text, nullable=False)
+
+    # 'pendente' -> 'enviando' -> 'enviada' | 'falhou' (dead-letter)
+    status = db.Column(db.String(20), default='pendente', nullable=False)
+    tentativas = db.Column(db.Integer, default=0, nullable=False)
+    proxima_tentativa = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc))
+    ultimo_erro = db.Column(db.String(500))
+
+    data_criacao = db.Column(db.DateTime, default=lambda: datetime.now(pytz.utc))
+    data_envio = db.Column(db.DateTime)
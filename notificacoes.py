@@ -0,0 +1,228 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from sqlalchemy import update
+
+from models import db, agora_utc, NotificacaoPendente
+from metricas import registro
+
+ENVIOS = registro.contador("twilio_envios_total", "Tentativas de envio de notificação, por resultado.", ("resultado",))
+DURACAO_ENVIO = registro.histograma("twilio_envio_duracao_segundos", "Latência de cada envio ao Twilio.", ("resultado",))
+DEAD_LETTER = registro.contador("twilio_dead_letter_total", "Notificações que esgotaram as tentativas.")
+
+
+# --- Senders (quem de fato entrega a mensagem) ---
+class TwilioSender:
+    # O Client (e o pool HTTP dele) nasce no primeiro envio de cada processo: o boot não paga
+    # o import do twilio.rest e um worker forkado não herda as conexões do processo pai.
+    # `timeout` (s) vale para cada chamada HTTP e tem de ficar abaixo do lease da fila
+    def __init__(self, account_sid, auth_token, remetente, timeout=30):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.remetente = remetente
+        self.timeout = timeout
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    from twilio.http.http_client import TwilioHttpClient
+                    from twilio.rest import Client
+                    self._client = Client(self.account_sid, self.auth_token,
+                                          http_client=TwilioHttpClient(timeout=self.timeout))
+                    self._pid = os.getpid()
+        return self._client
+
+    def enviar(self, destino, corpo):
+        self.client().messages.create(body=corpo, from_=self.remetente, to=destino)
+
+
+class FakeSender:
+    # Sender local, sem rede: serve para medir vazão/latência da fila e para testes
+    def __init__(self, latencia=0.0, taxa_falha=0.0):
+        self.latencia = latencia
+        self.taxa_falha = taxa_falha
+        self.enviadas = []
+        self._lock = threading.Lock()
+
+    def enviar(self, destino, corpo):
+        if self.latencia: time.sleep(self.latencia)
+        if self.taxa_falha and random.random() < self.taxa_falha:
+            raise RuntimeError("Falha simulada no FakeSender")
+        with self._lock:
+            self.enviadas.append((destino, corpo))
+
+
+# --- Fila persistente com workers em background ---
+class FilaNotificacoes:
+    def __init__(self, sender, num_workers=2, max_tentativas=5, backoff_base=5,
+                 backoff_max=600, intervalo_poll=5, lease_segundos=120, tamanho_lote=20):
+        self.sender = sender
+        self.num_workers = num_workers
+        self.max_tentativas = max_tentativas
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.intervalo_poll = intervalo_poll
+        self.lease_segundos = lease_segundos
+        self.tamanho_lote = tamanho_lote
+        # Um envio que passasse do lease seria repetido por outro worker com o primeiro ainda no ar
+        timeout_envio = getattr(sender, "timeout", None)
+        if timeout_envio is not None and timeout_envio >= lease_segundos:
+            raise ValueError(f"Timeout do sender ({timeout_envio}s) deve ser menor que o lease ({lease_segundos}s)")
+
+        self.app = None
+        self._evento = threading.Event()
+        self._parar = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+        # Contadores simples para medir vazão e latência de envio
+        self.total_enviadas = 0
+        self.total_falhas = 0
+        self.total_dead_letter = 0
+        self.latencias_envio = deque(maxlen=1000)
+
+    # Os workers sobem na primeira requisição de cada processo (não no import nem no
+    # processo pai do --preload), e a primeira volta já pega o que ficou de antes do
+    # restart: pendentes, backoffs vencidos e leases 'enviando' expirados
+    def init_app(self, app):
+        self.app = app
+        app.extensions['fila_notificacoes'] = self
+        app.before_request(self._iniciar)
+
+    # Adiciona na sessão atual: a notificação é gravada no mesmo commit do agendamento
+    def enfileirar(self, destino, corpo):
+        notificacao = NotificacaoPendente(destino=destino, corpo=corpo, proxima_tentativa=agora_utc())
+        db.session.add(notificacao)
+        return notificacao
+
+    # Chamar depois do commit para os workers não esperarem o próximo poll
+    def acordar(self):
+        self._iniciar()
+        self._evento.set()
+
+    def _iniciar(self):
+        if self.num_workers <= 0 or self.app is None: return
+        # Após um fork (gunicorn --preload) as threads do processo pai não existem no filho
+        if self._pid == os.getpid(): return
+        with self._lock:
+            if self._pid == os.getpid(): return
+            self._pid = os.getpid()
+            self._parar.clear()
+            self._threads = []
+            for i in range(self.num_workers):
+                t = threading.Thread(target=self._loop, name=f"notificacoes-{i}", daemon=True)
+                t.start(); self._threads.append(t)
+
+    def parar(self, timeout=5):
+        self._parar.set(); self._evento.set()
+        for t in self._threads: t.join(timeout)
+        self._threads = []; self._pid = None
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try:
+                with self.app.app_context():
+                    processadas = self.processar_lote()
+            except Exception as e:
+                print(f"Erro no worker de notificações: {e}"); processadas = 0
+            if not processadas:
+                self._evento.wait(self.intervalo_poll)
+                self._evento.clear()
+
+    def _reservar(self, notificacao_id, agora):
+        # UPDATE condicional: só um worker (de qualquer processo) consegue reservar a linha.
+        # A tentativa conta na reserva: um envio que derruba o worker (lease expirado) também gasta
+        resultado = db.session.execute(
+            update(NotificacaoPendente)
+            .where(NotificacaoPendente.id == notificacao_id,
+                   NotificacaoPendente.status.in_(['pendente', 'enviando']),
+                   NotificacaoPendente.proxima_tentativa <= agora,
+                   NotificacaoPendente.tentativas < self.max_tentativas)
+            .values(status='enviando', tentativas=NotificacaoPendente.tentativas + 1,
+                    proxima_tentativa=agora + timedelta(seconds=self.lease_segundos))
+        )
+        db.session.commit()
+        return resultado.rowcount == 1
+
+    # Lease expirado sem tentativas sobrando: o último envio nunca terminou, vai para a dead-letter
+    def _descartar_leases_esgotados(self, agora):
+        resultado = db.session.execute(
+            update(NotificacaoPendente)
+            .where(NotificacaoPendente.status == 'enviando',
+                   NotificacaoPendente.proxima_tentativa <= agora,
+                   NotificacaoPendente.tentativas >= self.max_tentativas)
+            .values(status='falhou', ultimo_erro="Lease expirado sem confirmação de envio")
+        )
+        db.session.commit()
+        if resultado.rowcount:
+            self.total_dead_letter += resultado.rowcount
+            DEAD_LETTER.inc(resultado.rowcount)
+            print(f"{resultado.rowcount} notificação(ões) com lease expirado movida(s) para dead-letter")
+
+    def _backoff(self, tentativas):
+        atraso = min(self.backoff_max, self.backoff_base * (2 ** (tentativas - 1)))
+        return atraso * random.uniform(0.8, 1.2)
+
+    # Processa um lote de notificações vencidas; retorna quantas foram tentadas
+    def processar_lote(self):
+        agora = agora_utc()
+        self._descartar_leases_esgotados(agora)
+        candidatas = [linha.id for linha in db.session.query(NotificacaoPendente.id).filter(
+            NotificacaoPendente.status.in_(['pendente', 'enviando']),
+            NotificacaoPendente.proxima_tentativa <= agora,
+            NotificacaoPendente.tentativas < self.max_tentativas
+        ).order_by(NotificacaoPendente.id).limit(self.tamanho_lote)]
+
+        processadas = 0
+        for notificacao_id in candidatas:
+            # Hora de cada linha: num lote lento, o lease das últimas não encolhe
+            if not self._reservar(notificacao_id, agora_utc()): continue
+            notificacao = db.session.get(NotificacaoPendente, notificacao_id)
+            inicio = time.perf_counter()
+            resultado = "sucesso"
+            try:
+                self.sender.enviar(notificacao.destino, notificacao.corpo)
+                notificacao.status = 'enviada'
+                notificacao.data_envio = agora_utc()
+                notificacao.ultimo_erro = None
+                self.total_enviadas += 1
+            except Exception as e:
+                resultado = "falha"
+                notificacao.ultimo_erro = str(e)[:500]
+                self.total_falhas += 1
+                if notificacao.tentativas >= self.max_tentativas:
+                    notificacao.status = 'falhou'
+                    self.total_dead_letter += 1
+                    DEAD_LETTER.inc()
+                    print(f"Notificação {notificacao.id} para {notificacao.destino} movida para dead-letter: {e}")
+                else:
+                    notificacao.status = 'pendente'
+                    notificacao.proxima_tentativa = agora_utc() + timedelta(seconds=self._backoff(notificacao.tentativas))
+            duracao = time.perf_counter() - inicio
+            self.latencias_envio.append(duracao)
+            ENVIOS.inc(resultado=resultado)
+            DURACAO_ENVIO.observar(duracao, resultado=resultado)
+            db.session.commit()
+            processadas += 1
+        return processadas
+
+    # Devolve as notificações da dead-letter para a fila. Fora do servidor (manutencao.py)
+    # não sobe workers: os do servidor pegam as linhas no próximo poll
+    def reenfileirar_falhas(self):
+        resultado = db.session.execute(
+            update(NotificacaoPendente)
+            .where(NotificacaoPendente.status == 'falhou')
+            .values(status='pendente', tentativas=0, proxima_tentativa=agora_utc())
+        )
+        db.session.commit()
+        if self._pid == os.getpid(): self._evento.set()
+        return resultado.rowcount
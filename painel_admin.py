@@ -0,0 +1,200 @@
+import base64
+import json
+import os
+import re
+from datetime import datetime
+
+from flask import g, redirect, request, url_for
+from flask_admin import Admin, AdminIndexView, expose
+from flask_admin.contrib.sqla import ModelView
+from flask_login import current_user
+from sqlalchemy import and_, or_, func, text
+from sqlalchemy.orm import Query
+
+from models import db, ler_da_replica, Usuario, Servico, Agendamento, User
+from sessoes import RedisEmMemoria
+
+# Contagens das listas: exatas, guardadas por ADMIN_CONTAGEM_TTL segundos por (SQL, parâmetros).
+# No Postgres, tabela sem filtro acima de ADMIN_CONTAGEM_ESTIMADA_ACIMA linhas usa a estimativa do planner.
+CONTAGEM_TTL = int(os.environ.get("ADMIN_CONTAGEM_TTL", 30))
+CONTAGEM_ESTIMADA_ACIMA = int(os.environ.get("ADMIN_CONTAGEM_ESTIMADA_ACIMA", 100000))
+
+
+class ConsultaContagem(Query):
+    cache = RedisEmMemoria(max_itens=512)
+
+    def _estimativa(self, tabela):
+        return self.session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"),
+                                    {"t": tabela}).scalar()
+
+    def scalar(self):
+        compilado = self.statement.compile(dialect=self.session.get_bind().dialect)
+        chave = f"{compilado}|{sorted(compilado.params.items())!r}"
+        contagem = self.cache.get(chave)
+        if contagem is not None: return contagem
+        if self.statement.whereclause is None and compilado.dialect.name == "postgresql":
+            estimativa = self._estimativa(self.statement.get_final_froms()[0].name)
+            if estimativa and estimativa > CONTAGEM_ESTIMADA_ACIMA: contagem = estimativa
+        if contagem is None: contagem = super().scalar()
+        self.cache.set(chave, contagem, ex=CONTAGEM_TTL)
+        return contagem
+
+
+# (a, b, id) depois de (x, y, z) na ordem dada: expandido em OR/AND para o planner usar o índice
+def depois_de(colunas, valores):
+    condicoes = []
+    for i, (coluna, decrescente) in enumerate(colunas):
+        anteriores = [c == v for (c, _), v in zip(colunas[:i], valores[:i])]
+        condicoes.append(and_(*anteriores, coluna < valores[i] if decrescente else coluna > valores[i]))
+    return or_(*condicoes)
+
+
+# "11 9999-1234", "+55119999" -> telefones gravados com e sem "+" e com o DDI do Brasil
+def prefixos_telefone(termo):
+    digitos = re.sub(r"\D", "", termo)
+    prefixos = {digitos, "+" + digitos}
+    if not digitos.startswith("55"): prefixos.add("+55" + digitos)
+    return sorted(prefixos)
+
+
+# Prefixo como intervalo [p, p'), que usa o índice único de telefone em qualquer banco/collation
+def condicao_prefixo(coluna, prefixo):
+    return and_(coluna >= prefixo, coluna < prefixo[:-1] + chr(ord(prefixo[-1]) + 1))
+
+
+def _escapar_like(termo):
+    return termo.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class MyAdminIndexView(AdminIndexView):
+    @expose('/')
+    def index(self):
+        if not current_user.is_authenticated: return redirect(url_for('rotas.login'))
+        return super().index()
+
+class SecureModelView(ModelView):
+    def is_accessible(self): return current_user.is_authenticated
+
+    def get_count_query(self):
+        return ConsultaContagem(func.count('*'), session=self.session()).select_from(self.model)
+
+    # Lista e exportação leem da réplica (se configurada); criar/editar/apagar ficam no primário
+    @expose('/')
+    def index_view(self):
+        ler_da_replica()
+        return super().index_view()
+
+    @expose('/export/<export_type>/')
+    def export(self, export_type):
+        ler_da_replica()
+        return super().export(export_type)
+
+# Sem ordenação escolhida na tela, a lista anda por cursor (?apos=) na ordem de
+# column_default_sort (que termina no id), em vez de OFFSET: páginas fundas custam o mesmo que a primeira
+class KeysetModelView(SecureModelView):
+    list_template = 'admin/lista_keyset.html'
+
+    def _colunas_keyset(self):
+        return [(getattr(self.model, nome), decrescente) for nome, decrescente in self.column_default_sort]
+
+    def _codificar_cursor(self, registro):
+        valores = [getattr(registro, nome) for nome, _ in self.column_default_sort]
+        bruto = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in valores])
+        return base64.urlsafe_b64encode(bruto.encode()).decode()
+
+    def _cursor_da_url(self):
+        try:
+            valores = json.loads(base64.urlsafe_b64decode(request.args["apos"].encode()))
+            return [datetime.fromisoformat(v) if coluna.type.python_type is datetime else v
+                    for v, (coluna, _) in zip(valores, self._colunas_keyset())]
+        except (KeyError, ValueError, TypeError):
+            return None
+
+    # O cursor não vai para os links de ordenação, filtros e paginação numerada (só para "Próxima")
+    def _get_list_extra_args(self):
+        view_args = super()._get_list_extra_args()
+        view_args.extra_args.pop("apos", None)
+        return view_args
+
+    def get_query(self):
+        consulta = super().get_query()
+        if g.get("admin_apos") is not None:
+            consulta = consulta.filter(depois_de(self._colunas_keyset(), g.admin_apos))
+        return consulta
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        keyset = sort_column is None and request.endpoint == f"{self.endpoint}.index_view"
+        g.admin_apos = self._cursor_da_url() if keyset else None
+        try:
+            contagem, dados = super().get_list(0 if g.admin_apos else page, sort_column, sort_desc,
+                                               search, filters, execute, page_size)
+        finally:
+            g.admin_apos = None
+        if keyset and execute and dados and len(dados) == (page_size or self.page_size):
+            g.admin_proximo_cursor = self._codificar_cursor(dados[-1])
+        return contagem, dados
+
+    # Links "Início" e "Próxima" do template; None quando a lista está ordenada por outra coluna
+    def navegacao_keyset(self, sort_column):
+        if sort_column is not None: return None
+        view_args = self._get_list_extra_args()
+        extra = view_args.extra_args
+        no_inicio = "apos" not in request.args and not view_args.page
+        proximo = g.get("admin_proximo_cursor")
+        return {
+            "inicio": None if no_inicio else self._get_list_url(view_args.clone(page=None, extra_args=extra)),
+            "proxima": self._get_list_url(view_args.clone(page=None, extra_args={**extra, "apos": proximo}))
+                       if proximo else None,
+        }
+
+class UsuarioModelView(KeysetModelView):
+    column_list = ['nome', 'telefone', 'estado_atual', 'last_interaction_time']
+    column_searchable_list = ['nome', 'telefone']
+    column_default_sort = [('id', True)]
+
+    def search_placeholder(self): return "Nome ou início do telefone"
+
+    # Números viram busca por prefixo no índice de telefone; texto, ILIKE no nome
+    # (com o índice de trigramas no Postgres, migração 5)
+    def _condicao_busca(self, termo):
+        if re.fullmatch(r"[\d\s+()\-]+", termo) and len(re.sub(r"\D", "", termo)) >= 2:
+            return or_(*(condicao_prefixo(Usuario.telefone, p) for p in prefixos_telefone(termo)))
+        return Usuario.nome.ilike(f"%{_escapar_like(termo)}%", escape="\\")
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # Um telefone digitado com espaços ("11 9999-1234") é um termo só
+        termos = [search.strip()] if re.fullmatch(r"[\d\s+()\-]+", search.strip()) else search.split()
+        for termo in filter(None, termos):
+            condicao = self._condicao_busca(termo)
+            query = query.filter(condicao)
+            if count_query is not None: count_query = count_query.filter(condicao)
+        return query, count_query, joins, count_joins
+
+class ServicoModelView(SecureModelView):
+    column_list = ['nome', 'duracao_minutos']
+    form_columns = ['nome', 'descricao', 'duracao_minutos']
+    catalogo = None
+
+    # Qualquer alteração no catálogo invalida o cache de todos os workers
+    def after_model_change(self, form, model, is_created): self.catalogo.invalidar()
+    def after_model_delete(self, model): self.catalogo.invalidar()
+
+class AgendamentoModelView(KeysetModelView):
+    column_list = ['usuario.nome', 'servico.nome', 'data_hora', 'status', 'endereco', 'queixa']
+    column_filters = ['status', 'data_hora', 'servico.nome']
+    # Cliente e serviço no mesmo SELECT (JOIN), não uma consulta por linha
+    column_select_related_list = [Agendamento.usuario, Agendamento.servico]
+    # Com filtro de status, a ordem (data_hora, id) sai do índice (status, data_hora, id)
+    column_default_sort = [('data_hora', True), ('id', True)]
+
+
+# Monta o Flask-Admin no app (opcional: só é importado quando o admin está habilitado)
+def init_admin(app, catalogo):
+    admin = Admin(app, name='Painel Admin', template_mode='bootstrap3', index_view=MyAdminIndexView())
+    servicos = ServicoModelView(Servico, db.session, name='Serviços')
+    servicos.catalogo = catalogo
+    admin.add_view(UsuarioModelView(Usuario, db.session))
+    admin.add_view(servicos)
+    admin.add_view(AgendamentoModelView(Agendamento, db.session))
+    admin.add_view(SecureModelView(User, db.session, name='Admins'))
+    return admin
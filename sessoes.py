@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+
+from models import db, agora_utc, SessaoConversa
+
+
+# Rascunho da conversa (serviço, data, endereço, queixa...) de um telefone
+class Sessao(dict):
+    def __init__(self, telefone, dados=None, nova=False):
+        super().__init__(dados or {})
+        self.telefone = telefone
+        self.nova = nova
+        self.linha = None
+
+
+# --- Backend SQL: a sessão é gravada no mesmo commit do webhook ---
+class SessoesSQL:
+    transacional = True
+
+    def __init__(self, ttl_segundos=900):
+        self.ttl_segundos = ttl_segundos
+
+    def carregar(self, telefone):
+        linha = db.session.get(SessaoConversa, telefone)
+        if linha is None or linha.expira_em <= agora_utc(): return None
+        sessao = Sessao(telefone, json.loads(linha.dados or "{}"))
+        sessao.linha = linha
+        return sessao
+
+    def salvar(self, sessao):
+        # Reaproveita a linha lida em carregar() (o identity map só guarda referências fracas)
+        linha = sessao.linha or db.session.get(SessaoConversa, sessao.telefone)
+        if linha is None:
+            linha = SessaoConversa(telefone=sessao.telefone); db.session.add(linha)
+        linha.dados = json.dumps(sessao)
+        linha.expira_em = agora_utc() + timedelta(seconds=self.ttl_segundos)
+
+    def apagar(self, telefone):
+        SessaoConversa.query.filter_by(telefone=telefone).delete()
+
+
+# --- Backend compatível com Redis (GET / SET ex= / DELETE), com TTL nativo ---
+class SessoesRedis:
+    # Fora da transação do banco: só é gravada depois do commit
+    transacional = False
+
+    def __init__(self, cliente, ttl_segundos=900, prefixo="sessao:"):
+        self.cliente = cliente
+        self.ttl_segundos = ttl_segundos
+        self.prefixo = prefixo
+
+    def carregar(self, telefone):
+        valor = self.cliente.get(self.prefixo + telefone)
+        if valor is None: return None
+        if isinstance(valor, bytes): valor = valor.decode()
+        return Sessao(telefone, json.loads(valor))
+
+    def salvar(self, sessao):
+        self.cliente.set(self.prefixo + sessao.telefone, json.dumps(sessao), ex=self.ttl_segundos)
+
+    def apagar(self, telefone):
+        self.cliente.delete(self.prefixo + telefone)
+
+
+# Substituto em memória do Redis (testes, desenvolvimento e caches locais por worker).
+# Com max_itens, as chaves mais antigas são descartadas quando o limite é atingido.
+class RedisEmMemoria:
+    def __init__(self, max_itens=None):
+        self.max_itens = max_itens
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _vivo(self, chave):
+        item = self._dados.get(chave)
+        if item is None: return None
+        valor, expira = item
+        if expira is not None and expira <= time.monotonic():
+            del self._dados[chave]; return None
+        return valor
+
+    def get(self, chave):
+        with self._lock:
+            return self._vivo(chave)
+
+    def set(self, chave, valor, ex=None, nx=False):
+        with self._lock:
+            if nx and self._vivo(chave) is not None: return None
+            self._dados.pop(chave, None)
+            self._dados[chave] = (valor, time.monotonic() + ex if ex else None)
+            if self.max_itens:
+                while len(self._dados) > self.max_itens: self._dados.popitem(last=False)
+        return True
+
+    def delete(self, *chaves):
+        with self._lock:
+            return sum(1 for c in chaves if self._dados.pop(c, None) is not None)
@@ -0,0 +1,52 @@
+# O app é montado no import (app.py), então o ambiente vem antes: banco SQLite temporário,
+# Twilio falso e nenhum worker de notificações em background (os testes chamam processar_lote).
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'testes.db')}"
+os.environ["NOTIFICACOES_SENDER"] = "fake"
+os.environ["NOTIFICACOES_WORKERS"] = "0"
+os.environ.setdefault("FLASK_SECRET_KEY", "testes")
+
+import pytest
+
+# Tabelas mantidas entre os testes (catálogo e controle de versão)
+TABELAS_FIXAS = {"servico", "versao_catalogo", "versao_schema", "user"}
+
+
+@pytest.fixture(scope="session")
+def modulo_app():
+    import app as modulo_app
+    from migracoes import migrar
+    from models import db, Servico
+    with modulo_app.app.app_context():
+        migrar()
+        db.session.add_all([Servico(nome="Limpeza", duracao_minutos=60),
+                            Servico(nome="Instalação", duracao_minutos=120)])
+        db.session.commit()
+    return modulo_app
+
+
+@pytest.fixture
+def banco(modulo_app):
+    from models import db
+    with modulo_app.app.app_context():
+        yield db
+        db.session.rollback()
+        for tabela in reversed(db.metadata.sorted_tables):
+            if tabela.name not in TABELAS_FIXAS: db.session.execute(tabela.delete())
+        db.session.commit()
+
+
+@pytest.fixture
+def cliente(modulo_app, banco):
+    return modulo_app.app.test_client()
+
+
+@pytest.fixture
+def servicos(banco):
+    from models import Servico
+    return {s.nome: s for s in Servico.query}
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from disponibilidade import SlotIndisponivel
+from models import Agendamento, ReservaSlot, Usuario
+
+# 05/03/2031, 09:00 em São Paulo (UTC-3): as colunas guardam UTC "naive"
+NOVE_HORAS = datetime(2031, 3, 5, 12)
+ANTES = datetime(2031, 1, 1)
+
+
+@pytest.fixture
+def usuario(banco):
+    usuario = Usuario(telefone="+5511999990000", nome="Cliente")
+    banco.session.add(usuario); banco.session.commit()
+    return usuario
+
+
+def agendar(banco, usuario, servico, data_hora, **campos):
+    agendamento = Agendamento(usuario_id=usuario.id, servico_id=servico.id, data_hora=data_hora, **campos)
+    banco.session.add(agendamento); banco.session.commit()
+    return agendamento
+
+
+def slots(agendamento_id):
+    return sorted(r.slot_inicio for r in ReservaSlot.query.filter_by(agendamento_id=agendamento_id))
+
+
+def horas_livres(modulo_app, duracao=60):
+    dia = NOVE_HORAS.date()
+    return [h.hour for h in modulo_app.disponibilidade.horarios_livres(dia, duracao, modulo_app.brasil_tz.localize(ANTES))]
+
+
+def test_segundo_agendamento_no_mesmo_slot_e_recusado(banco, usuario, servicos):
+    agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS)
+    with pytest.raises(SlotIndisponivel):
+        agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS)
+    banco.session.rollback()
+    assert Agendamento.query.count() == 1
+
+
+def test_servico_longo_reserva_os_slots_seguintes(modulo_app, banco, usuario, servicos):
+    instalacao = agendar(banco, usuario, servicos["Instalação"], NOVE_HORAS)
+    assert slots(instalacao.id) == [NOVE_HORAS, NOVE_HORAS + timedelta(hours=1)]
+    assert 9 not in horas_livres(modulo_app) and 10 not in horas_livres(modulo_app)
+    with pytest.raises(SlotIndisponivel):
+        agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS + timedelta(hours=1))
+
+
+def test_fora_da_grade_ocupa_todos_os_slots_que_toca(modulo_app, banco, usuario, servicos):
+    # 09:30-10:30: ocupa o slot das 9h e o das 10h, tanto nas reservas quanto nos horários oferecidos
+    fora = agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS + timedelta(minutes=30))
+    assert slots(fora.id) == [NOVE_HORAS, NOVE_HORAS + timedelta(hours=1)]
+    livres = horas_livres(modulo_app)
+    assert 9 not in livres and 10 not in livres and 11 in livres
+    with pytest.raises(SlotIndisponivel):
+        agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS + timedelta(hours=1))
+
+
+def test_mover_para_slot_ocupado_mantem_o_original(banco, usuario, servicos):
+    agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS)
+    outro = agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS + timedelta(hours=2))
+    outro.data_hora = NOVE_HORAS
+    with pytest.raises(SlotIndisponivel):
+        banco.session.commit()
+    banco.session.rollback()
+    assert slots(outro.id) == [NOVE_HORAS + timedelta(hours=2)]
+
+
+@pytest.mark.parametrize("status", ["Concluido", "Cancelado"])
+def test_sair_dos_abertos_libera_o_slot(modulo_app, banco, usuario, servicos, status):
+    agendamento = agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS)
+    agendamento.status = status; banco.session.commit()
+    assert slots(agendamento.id) == [] and 9 in horas_livres(modulo_app)
+    agendar(banco, usuario, servicos["Limpeza"], NOVE_HORAS)
+    agendamento.status = "Aberto"
+    with pytest.raises(SlotIndisponivel):
+        banco.session.commit()
+
+
+def test_historico_nao_reserva(banco, usuario, servicos):
+    # Concluídos e abertos já passados não disputam vaga (legado com o mesmo horário repetido)
+    passado = datetime(2020, 1, 10, 12)
+    historico = [agendar(banco, usuario, servicos["Limpeza"], passado, status=status)
+                 for status in ("Concluido", "Concluido", "Aberto", "Aberto")]
+    assert [slots(a.id) for a in historico] == [[], [], [], []]
+
+
+def test_bot_oferece_os_horarios_restantes_quando_perde_a_vaga(modulo_app, cliente):
+    def enviar(telefone, texto):
+        return cliente.post("/bot", data={"From": f"whatsapp:{telefone}", "Body": texto}).get_data(as_text=True)
+
+    data = (datetime.now() + timedelta(days=400)).strftime("%d/%m/%Y")
+    telefones = ("+5511900000001", "+5511900000002")
+    for telefone in telefones:
+        for texto in ["oi", "Cliente", "2", "1", "Rua 1", "não gela", "9000", "LG", data]:
+            enviar(telefone, texto)
+    assert "recebida" in enviar(telefones[0], "1")
+    resposta = enviar(telefones[1], "1")
+    assert "acabou de ser reservado" in resposta
+    assert "recebida" in enviar(telefones[1], "1")
+    assert Agendamento.query.count() == 2
@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+from config import dimensionar_threads
+from limitador import BaldeMemoria, LimitadorWebhook
+
+
+def test_balde_por_telefone():
+    balde = BaldeMemoria(capacidade=3, taxa=0.001)
+    assert [balde.permitir("+551") for _ in range(4)] == [True, True, True, False]
+    assert balde.permitir("+552")
+
+
+def test_teto_de_concorrencia_recusa_e_libera():
+    limitador = LimitadorWebhook(BaldeMemoria(100, 1), max_concorrentes=2)
+    dentro, soltar = threading.Barrier(3), threading.Event()
+
+    def segurar(telefone):
+        with limitador.entrar(telefone) as recusa:
+            assert recusa is None
+            dentro.wait(); soltar.wait()
+
+    threads = [threading.Thread(target=segurar, args=(str(i),)) for i in range(2)]
+    for t in threads: t.start()
+    dentro.wait()
+    with limitador.entrar("x") as recusa:
+        assert recusa is not None and LimitadorWebhook.RESPOSTA_CONCORRENCIA in recusa
+    soltar.set()
+    for t in threads: t.join()
+    with limitador.entrar("x") as recusa:
+        assert recusa is None
+    assert limitador.rejeitadas == {"telefone": 0, "concorrencia": 1}
+
+
+def test_tetos_saem_das_threads_do_worker(monkeypatch):
+    for variavel in ("GUNICORN_THREADS", "SSE_MAX_CONEXOES", "BOT_MAX_CONCORRENTES"):
+        monkeypatch.delenv(variavel, raising=False)
+    assert dimensionar_threads() == {"threads": 16, "sse": 4, "bot": 10}
+    monkeypatch.setenv("BOT_MAX_CONCORRENTES", "12")
+    with pytest.raises(ValueError):
+        dimensionar_threads()
+    monkeypatch.setenv("BOT_MAX_CONCORRENTES", "0")
+    assert dimensionar_threads()["bot"] == 0
+    monkeypatch.setenv("SSE_MAX_CONEXOES", "15")
+    with pytest.raises(ValueError):
+        dimensionar_threads()
+
+
+def test_reenvio_responde_igual_sem_gastar_ficha(modulo_app, cliente, monkeypatch):
+    monkeypatch.setattr(modulo_app, "limitador", LimitadorWebhook(BaldeMemoria(capacidade=2, taxa=0.001)))
+    def enviar(sid):
+        return cliente.post("/bot", data={"From": "whatsapp:+5511911110000", "Body": "oi", "MessageSid": sid}).get_data(as_text=True)
+
+    primeira = enviar("SM1")
+    assert all(enviar("SM1") == primeira for _ in range(5))
+    assert LimitadorWebhook.RESPOSTA_TELEFONE not in enviar("SM2")
+    assert LimitadorWebhook.RESPOSTA_TELEFONE in enviar("SM3")
+    # A recusa não consome o SID: o reenvio, com ficha de novo, é processado de verdade
+    modulo_app.limitador.balde._baldes.clear()
+    assert LimitadorWebhook.RESPOSTA_TELEFONE not in enviar("SM3")
@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from sqlalchemy import create_engine, inspect, text
+
+from migracoes import COLUNAS_RASCUNHO_ANTIGAS, MIGRACOES, _BASELINE, migrar
+from models import db
+
+
+def esquema(engine):
+    inspetor = inspect(engine)
+    return {tabela: (sorted((c["name"], str(c["type"]), c["nullable"]) for c in inspetor.get_columns(tabela)),
+                     sorted((i["name"], tuple(i["column_names"]), bool(i["unique"])) for i in inspetor.get_indexes(tabela)),
+                     sorted(str(u["column_names"]) for u in inspetor.get_unique_constraints(tabela)))
+            for tabela in inspetor.get_table_names() if tabela != "versao_schema"}
+
+
+def test_banco_novo_e_banco_antigo_terminam_como_o_modelo(tmp_path):
+    novo, antigo, modelo = (create_engine(f"sqlite:///{tmp_path / nome}.db") for nome in ("novo", "antigo", "modelo"))
+    _BASELINE.create_all(antigo)
+    assert migrar(novo) == migrar(antigo) == [versao for versao, _, _ in MIGRACOES]
+    db.metadata.create_all(modelo)
+    assert esquema(novo) == esquema(antigo) == esquema(modelo)
+    assert migrar(novo) == []
+
+
+def test_migrar_banco_antigo_preserva_dados_e_reserva_os_abertos(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'antigo.db'}")
+    _BASELINE.create_all(engine)
+    with engine.begin() as conexao:
+        conexao.execute(text("INSERT INTO usuario (id, telefone, nome, temp_data) VALUES (1, '+551', 'Cliente', '10/12/2030')"))
+        conexao.execute(text("INSERT INTO servico (id, nome, duracao_minutos) VALUES (1, 'Limpeza', 60)"))
+        conexao.execute(text("INSERT INTO agendamento (usuario_id, servico_id, data_hora, status, data_criacao) "
+                             "VALUES (1, 1, :futuro, 'Aberto', :criacao), (1, 1, :passado, 'Concluido', :criacao)"),
+                        {"futuro": datetime(2031, 3, 5, 12), "passado": datetime(2020, 3, 5, 12),
+                         "criacao": datetime(2020, 3, 1)})
+    migrar(engine)
+    with engine.connect() as conexao:
+        assert conexao.execute(text("SELECT nome FROM usuario WHERE id = 1")).scalar() == "Cliente"
+        assert conexao.execute(text("SELECT COUNT(*) FROM agendamento WHERE atualizado_em IS NOT NULL")).scalar() == 2
+        reservas = conexao.execute(text("SELECT agendamento_id FROM reserva_slot")).scalars().all()
+    assert reservas == [1]
+    assert not set(COLUNAS_RASCUNHO_ANTIGAS) & {c["name"] for c in inspect(engine).get_columns("usuario")}
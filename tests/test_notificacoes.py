@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import update
+
+from models import agora_utc, NotificacaoPendente
+from notificacoes import FakeSender, FilaNotificacoes, TwilioSender
+
+
+def enfileirar(banco, corpo="Novo agendamento"):
+    notificacao = NotificacaoPendente(destino="whatsapp:+5500", corpo=corpo, proxima_tentativa=agora_utc())
+    banco.session.add(notificacao); banco.session.commit()
+    return notificacao.id
+
+
+def vencer(banco, notificacao_id):
+    # Pula o backoff / lease: a linha volta a ser elegível agora
+    banco.session.execute(update(NotificacaoPendente).where(NotificacaoPendente.id == notificacao_id)
+                          .values(proxima_tentativa=agora_utc() - timedelta(seconds=1)))
+    banco.session.commit()
+
+
+def test_timeout_do_sender_abaixo_do_lease():
+    with pytest.raises(ValueError):
+        FilaNotificacoes(TwilioSender("sid", "token", "whatsapp:+1", timeout=120), num_workers=0, lease_segundos=120)
+    FilaNotificacoes(TwilioSender("sid", "token", "whatsapp:+1", timeout=30), num_workers=0, lease_segundos=120)
+
+
+def test_envio_com_sucesso(banco):
+    sender = FakeSender()
+    fila = FilaNotificacoes(sender, num_workers=0)
+    notificacao_id = enfileirar(banco)
+    assert fila.processar_lote() == 1
+    notificacao = banco.session.get(NotificacaoPendente, notificacao_id)
+    assert (notificacao.status, notificacao.tentativas) == ("enviada", 1)
+    assert sender.enviadas == [("whatsapp:+5500", "Novo agendamento")]
+
+
+def test_reserva_e_exclusiva_e_conta_a_tentativa(banco):
+    fila = FilaNotificacoes(FakeSender(), num_workers=0)
+    notificacao_id = enfileirar(banco)
+    assert fila._reservar(notificacao_id, agora_utc())
+    # Lease em vigor: outro worker não pega a mesma linha
+    assert not fila._reservar(notificacao_id, agora_utc())
+    assert banco.session.get(NotificacaoPendente, notificacao_id).tentativas == 1
+
+
+def test_falhas_esgotam_as_tentativas(banco):
+    fila = FilaNotificacoes(FakeSender(taxa_falha=1.0), num_workers=0, max_tentativas=3, backoff_base=0)
+    notificacao_id = enfileirar(banco)
+    for _ in range(5):
+        vencer(banco, notificacao_id); fila.processar_lote()
+    notificacao = banco.session.get(NotificacaoPendente, notificacao_id)
+    assert (notificacao.status, notificacao.tentativas) == ("falhou", 3)
+
+
+def test_lease_expirado_sem_tentativas_vai_para_dead_letter(banco):
+    # Envios que derrubam o worker: a linha fica em 'enviando' e cada reserva gasta uma tentativa
+    fila = FilaNotificacoes(FakeSender(), num_workers=0, max_tentativas=3)
+    notificacao_id = enfileirar(banco)
+    for _ in range(3):
+        assert fila._reservar(notificacao_id, agora_utc())
+        vencer(banco, notificacao_id)
+    assert not fila._reservar(notificacao_id, agora_utc())
+    fila.processar_lote()
+    notificacao = banco.session.get(NotificacaoPendente, notificacao_id)
+    assert (notificacao.status, notificacao.tentativas) == ("falhou", 3)
+    assert fila.sender.enviadas == []
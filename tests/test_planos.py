@@ -0,0 +1,24 @@
+# Rodam em processos próprios (banco e app separados dos outros testes), como na linha de comando
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmark import medir_inicializacao
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Boot de um worker (import do app.py + create_app()); folgado, pega só regressões grosseiras
+LIMITE_INICIALIZACAO_MS = 5000
+
+
+def test_consultas_quentes_usam_indice():
+    resultado = subprocess.run([sys.executable, "verificar_planos.py", "--agendamentos", "5000"],
+                               cwd=RAIZ, capture_output=True, text=True)
+    assert resultado.returncode == 0, resultado.stdout + resultado.stderr
+    assert "FALHOU" not in resultado.stdout
+
+
+def test_tempo_de_inicializacao():
+    database_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'boot.db')}"
+    tempos = medir_inicializacao(database_url, repeticoes=2)
+    assert tempos["import_app"]["max_ms"] + tempos["create_app"]["max_ms"] < LIMITE_INICIALIZACAO_MS, tempos
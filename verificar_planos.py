@@ -0,0 +1,188 @@
+"""Confere, com EXPLAIN, que as consultas quentes usam índice (nenhum seq scan).
+
+Uso:
+    python verificar_planos.py                                   # SQLite temporário, 50 mil agendamentos
+    python verificar_planos.py --database-url postgresql://...   # banco de teste (vazio ou já semeado)
+    python verificar_planos.py --agendamentos 200000 --sem-semear
+
+Aplica as migrações, semeia o banco (a maioria dos agendamentos concluídos, como
+em produção), roda ANALYZE e falha (código 1) se alguma consulta cair em varredura
+sequencial de uma tabela grande.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+# Tabelas pequenas, em que um seq scan é a escolha certa do planner
+TABELAS_PEQUENAS = {"servico", "versao_catalogo", "versao_schema"}
+TAMANHO_LOTE = 5000
+
+
+def _inserir(conexao, tabela, linhas):
+    for i in range(0, len(linhas), TAMANHO_LOTE):
+        conexao.execute(tabela.insert(), linhas[i:i + TAMANHO_LOTE])
+
+
+def semear(engine, num_agendamentos):
+    from models import Usuario, Servico, Agendamento, EventoAgendamento, NotificacaoPendente
+    agora = datetime.now(pytz.utc).replace(tzinfo=None)
+    aleatorio = random.Random(42)
+    num_usuarios = max(1, num_agendamentos // 2)
+    status = ["Concluido"] * 18 + ["Aberto", "Confirmado"]
+
+    with engine.begin() as conexao:
+        _inserir(conexao, Servico.__table__, [
+            {"nome": f"Serviço {i}", "duracao_minutos": 60 * (1 + i % 2)} for i in range(5)])
+        servicos = [s for (s,) in conexao.execute(Servico.__table__.select().with_only_columns(Servico.__table__.c.id))]
+        _inserir(conexao, Usuario.__table__, [
+            {"telefone": f"+55{i:011d}", "nome": f"Cliente {i}", "estado_atual": "menu_principal",
+             "last_interaction_time": agora - timedelta(minutes=aleatorio.randint(0, 525600))}
+            for i in range(num_usuarios)])
+        primeiro_usuario = conexao.execute(Usuario.__table__.select().with_only_columns(
+            Usuario.__table__.c.id).order_by(Usuario.__table__.c.id).limit(1)).scalar()
+        agendamentos = []
+        for i in range(num_agendamentos):
+            data_hora = (agora - timedelta(days=700) + timedelta(days=aleatorio.randint(0, 760))).replace(
+                hour=aleatorio.randint(12, 19), minute=0, second=0, microsecond=0)
+            agendamentos.append({
+                "usuario_id": primeiro_usuario + aleatorio.randrange(num_usuarios),
+                "servico_id": aleatorio.choice(servicos), "data_hora": data_hora,
+                "status": "Aberto" if data_hora > agora else aleatorio.choice(status),
+                "data_criacao": data_hora - timedelta(days=3), "atualizado_em": data_hora,
+                "endereco": f"Rua {i}", "queixa": "não gela"})
+        _inserir(conexao, Agendamento.__table__, agendamentos)
+        _inserir(conexao, EventoAgendamento.__table__, [
+            {"agendamento_id": i + 1, "tipo": "novo", "data_criacao": agora} for i in range(num_agendamentos)])
+        _inserir(conexao, NotificacaoPendente.__table__, [
+            {"destino": "whatsapp:+5500", "corpo": "Novo agendamento", "status": "enviada" if i % 50 else "pendente",
+             "tentativas": 0, "proxima_tentativa": agora - timedelta(minutes=i % 90), "data_criacao": agora}
+            for i in range(num_agendamentos)])
+        conexao.exec_driver_sql("ANALYZE")
+
+
+def consultas_quentes(modulo_app):
+    from sqlalchemy import or_
+    from sqlalchemy.orm import joinedload
+    from models import db, Usuario, Agendamento, EventoAgendamento, NotificacaoPendente
+    from painel_admin import depois_de, condicao_prefixo, prefixos_telefone
+    agora = datetime.now(pytz.utc).replace(tzinfo=None)
+    amanha = agora.date() + timedelta(days=1)
+    inicio = modulo_app.disponibilidade._inicio_dia_utc(amanha)
+    cursor = (agora + timedelta(days=10), 1000)
+    eager = (joinedload(Agendamento.usuario), joinedload(Agendamento.servico))
+    pagina = modulo_app.LIMITE_MAXIMO_API // 10 + 1
+    colunas_admin = [(Agendamento.data_hora, True), (Agendamento.id, True)]
+
+    return {
+        "disponibilidade (um dia)": modulo_app.disponibilidade.consulta_ocupacao(inicio, inicio + timedelta(days=1)),
+        "disponibilidade (30 dias)": modulo_app.disponibilidade.consulta_ocupacao(inicio, inicio + timedelta(days=30)),
+        "abertos (primeira página)": modulo_app._consulta_apos_cursor(
+            modulo_app.consulta_abertos().options(*eager), None, False).limit(pagina),
+        "abertos (após cursor)": modulo_app._consulta_apos_cursor(
+            modulo_app.consulta_abertos().options(*eager), cursor, False).limit(pagina),
+        "concluidos (primeira página)": modulo_app._consulta_apos_cursor(
+            modulo_app.consulta_concluidos().options(*eager), None, True).limit(pagina),
+        "concluidos (após cursor)": modulo_app._consulta_apos_cursor(
+            modulo_app.consulta_concluidos().options(*eager), (agora - timedelta(days=300), 1000), True).limit(pagina),
+        "admin: status + período": Agendamento.query.filter(
+            Agendamento.status == "Confirmado", Agendamento.data_hora >= agora - timedelta(days=30),
+            Agendamento.data_hora < agora).order_by(Agendamento.data_hora.desc()).limit(20),
+        "admin: agendamentos por status (após cursor)": Agendamento.query.options(*eager).filter(
+            Agendamento.status == "Concluido",
+            depois_de(colunas_admin, [agora - timedelta(days=300), 1000])).order_by(
+            Agendamento.data_hora.desc(), Agendamento.id.desc()).limit(20),
+        "admin: busca por telefone": Usuario.query.filter(or_(
+            *(condicao_prefixo(Usuario.telefone, p) for p in prefixos_telefone("11 0000 12")))).limit(20),
+        "admin: usuários por última interação": Usuario.query.filter(
+            Usuario.last_interaction_time >= agora - timedelta(days=2)).limit(20),
+        "bot: usuário por telefone": Usuario.query.filter_by(telefone="+5500000000123"),
+        "agendamentos do usuário": Agendamento.query.filter_by(usuario_id=123),
+        "feed ?since=": db.session.query(EventoAgendamento.id, EventoAgendamento.agendamento_id).filter(
+            EventoAgendamento.id > 1000).order_by(EventoAgendamento.id).limit(modulo_app.LIMITE_MAXIMO_API),
+        "fila de notificações": db.session.query(NotificacaoPendente.id).filter(
+            NotificacaoPendente.status.in_(["pendente", "enviando"]),
+            NotificacaoPendente.proxima_tentativa <= agora,
+            NotificacaoPendente.tentativas < 5).order_by(NotificacaoPendente.id).limit(50),
+    }
+
+
+def _sql_literal(consulta, dialeto):
+    # Valores literais: é o que o psycopg2 manda ao Postgres, e o que deixa o planner usar índices parciais
+    return str(consulta.statement.compile(dialect=dialeto, compile_kwargs={"literal_binds": True}))
+
+
+def _varreduras_sqlite(conexao, sql):
+    linhas = conexao.exec_driver_sql("EXPLAIN QUERY PLAN " + sql).fetchall()
+    plano = [linha[-1] for linha in linhas]
+    varreduras = []
+    for detalhe in plano:
+        if detalhe.startswith("SCAN ") and "USING" not in detalhe:
+            tabela = detalhe.split()[1]
+            if tabela not in TABELAS_PEQUENAS: varreduras.append(tabela)
+    return plano, varreduras
+
+
+def _varreduras_postgres(conexao, sql):
+    plano = conexao.exec_driver_sql("EXPLAIN (FORMAT JSON) " + sql).scalar()
+    if isinstance(plano, str): plano = json.loads(plano)
+    varreduras = []
+    def visitar(no):
+        if no.get("Node Type") == "Seq Scan" and no.get("Relation Name") not in TABELAS_PEQUENAS:
+            varreduras.append(no.get("Relation Name"))
+        for filho in no.get("Plans", []): visitar(filho)
+    visitar(plano[0]["Plan"])
+    return plano, varreduras
+
+
+def verificar(modulo_app, mostrar_planos=False):
+    from models import db
+    falhas = []
+    with db.engine.connect() as conexao:
+        postgres = conexao.dialect.name == "postgresql"
+        for nome, consulta in consultas_quentes(modulo_app).items():
+            sql = _sql_literal(consulta, conexao.dialect)
+            plano, varreduras = (_varreduras_postgres if postgres else _varreduras_sqlite)(conexao, sql)
+            print(f"{'FALHOU' if varreduras else 'ok':<7} {nome}" + (f"  (seq scan em {', '.join(varreduras)})" if varreduras else ""))
+            if mostrar_planos or varreduras:
+                print("        " + (json.dumps(plano) if postgres else "\n        ".join(plano)))
+            if varreduras: falhas.append(nome)
+    return falhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", help="Banco de teste (padrão: SQLite temporário)")
+    parser.add_argument("--agendamentos", type=int, default=50000)
+    parser.add_argument("--sem-semear", action="store_true", help="Usa os dados que já estão no banco")
+    parser.add_argument("--mostrar-planos", action="store_true")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'planos.db')}"
+    os.environ.setdefault("NOTIFICACOES_SENDER", "fake")
+    os.environ.setdefault("FLASK_SECRET_KEY", "planos")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as modulo_app
+    from migracoes import migrar
+    from models import db
+
+    with modulo_app.app.app_context():
+        migrar()
+        if not args.sem_semear:
+            inicio = time.perf_counter()
+            semear(db.engine, args.agendamentos)
+            print(f"{args.agendamentos} agendamentos semeados em {time.perf_counter() - inicio:.1f}s")
+        falhas = verificar(modulo_app, args.mostrar_planos)
+
+    if falhas:
+        print(f"Consultas com seq scan: {', '.join(falhas)}"); sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()